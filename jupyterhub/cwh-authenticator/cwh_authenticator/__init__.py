@@ -1,6 +1,8 @@
+from coursewareuserspawner.restuser import RestUserClient, user_ids
 from jupyterhub.handlers import LogoutHandler
 from jhub_remote_user_authenticator.remote_user_auth import RemoteUserLocalAuthenticator
 from jhub_remote_user_authenticator.remote_user_auth import RemoteUserLoginHandler
+from traitlets import Unicode
 
 
 class CoursewareHubLoginHandler(RemoteUserLoginHandler):
@@ -28,6 +30,25 @@ class CoursewareHubLogoutHandler(LogoutHandler):
 
 class CoursewareHubRemoteUserLocalAuthenticator(RemoteUserLocalAuthenticator):
 
+    restuser_socket_path = Unicode(
+        "/var/run/restuser.sock",
+        config=True,
+        help="Path of the UNIX domain socket of restuser service"
+    )
+
+    def system_user_exists(self, user):
+        # users are created on the host by restuser service
+        return user_ids.get(user.name) is not None
+
+    async def add_system_user(self, user):
+        """
+        Add a system user via restuser service, which also returns
+        the user ID if the user exists.
+        """
+        client = RestUserClient.instance(self.restuser_socket_path)
+        await user_ids.resolve(
+            user.name, lambda: client.get_uid(user.name))
+
     def get_handlers(self, app):
         return [
             (r'/login', CoursewareHubLoginHandler),
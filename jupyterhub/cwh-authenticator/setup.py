@@ -9,7 +9,10 @@ setup_args = dict(
     platforms            = "Linux",
     packages             = find_packages(),
     include_package_data = False,
-    install_requires     = ['jhub_remote_user_authenticator']
+    install_requires     = [
+        'jhub_remote_user_authenticator',
+        'coursewareuserspawner'
+    ]
 )
 
 
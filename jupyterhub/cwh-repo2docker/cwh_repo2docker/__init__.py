@@ -1,18 +1,87 @@
+import asyncio
 import os
 import re
+import stat
 import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+from docker.errors import APIError
+from docker.types import Placement
 from jupyterhub.spawner import Spawner
 from coursewareuserspawner import CoursewareUserSpawner
+from coursewareuserspawner.dockerapi import DockerAPI
+from coursewareuserspawner.metrics import SpawnPhase, time_phase
 from jinja2 import Environment, BaseLoader
 from traitlets import (
+    Dict,
+    Enum,
+    Float,
+    Integer,
     List,
     Tuple,
     Unicode,
 )
 from tornado import web
 
+from .catalog import ImageConfig
+from .locality import ImageLocality
 from .registry import get_registry, split_image_name
+from .warmpool import WarmPool
+
+
+_template_env = Environment(loader=BaseLoader)
+
+
+# configurations of images outside the registry, keyed by image ID
+# or digest-pinned reference, which always name the same image
+_local_image_configs = OrderedDict()
+_local_image_configs_max = 256
+
+
+def _local_image_config_key(image):
+    if image.startswith('sha256:'):
+        return image
+    if '@' in image:
+        return image
+    return None
+
+
+def _get_local_image_config(key):
+    config = _local_image_configs.get(key)
+    if config is not None:
+        _local_image_configs.move_to_end(key)
+    return config
+
+
+def _put_local_image_config(key, config):
+    _local_image_configs[key] = config
+    _local_image_configs.move_to_end(key)
+    while len(_local_image_configs) > _local_image_configs_max:
+        _local_image_configs.popitem(last=False)
+
+
+@lru_cache(maxsize=8)
+def _compile_template(source):
+    return _template_env.from_string(source)
+
+
+@lru_cache(maxsize=64)
+def _render_image_form(source, images, registry_host, selected):
+    """
+    Render the options form for a `SpawnableImages` view.
+
+    Views are replaced when the catalog changes, so rendered forms are
+    cached for the view with each selected image.
+    """
+    image_list = [
+        dict(i._asdict(), selected=(i.image_name == selected))
+        for i in images
+    ]
+    return _compile_template(source).render(
+        image_list=image_list, registry_host=registry_host)
 
 
 class Repo2DockerSpawner(CoursewareUserSpawner):
@@ -110,13 +179,125 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
         **CoursewareUserSpawner.non_admin_home_mount_dirs.metadata
     )
 
+    dir_provision_threads = Integer(
+        4,
+        config=True,
+        help="""
+        Number of threads that create users' home and course directories.
+
+        The directories are often on NFS, so that they are created off the
+        event loop in a dedicated thread pool.
+        """,
+    )
+
+    _dir_executor = None
+
+    warm_pool_sizes = Dict(
+        key_trait=Unicode(),
+        value_trait=Integer(),
+        config=True,
+        help="""
+        Number of placeholder services to keep for each course image,
+        keyed by the image name in the registry, e.g. `course-a:latest`.
+
+        A spawn of the image claims a placeholder service and runs on
+        the node of the placeholder, which has already pulled the image.
+        The spawn falls back to a normal spawn if the pool is empty, and
+        to any node if the task cannot be scheduled on the placeholder's
+        node within `image_locality_fallback_timeout`, unless
+        `image_locality` is `strict`.  Disabled by default.
+        """,
+    )
+
+    warm_pool_refill_interval = Float(
+        30.0,
+        config=True,
+        help="Interval in seconds between refills of the warm pool.",
+    )
+
+    image_locality = Enum(
+        ['off', 'prefer', 'strict'],
+        'off',
+        config=True,
+        help="""
+        Place single-user servers on the nodes that already hold the image.
+
+        - `off`: leave placement to Swarm.
+        - `prefer`: pin the service to the least loaded node holding the
+          image, and unpin it if Swarm cannot schedule it there within
+          `image_locality_fallback_timeout`.
+        - `strict`: pin the service without falling back.
+
+        If no node holds the image, the service is not pinned.
+        """,
+    )
+
+    image_locality_refresh_interval = Float(
+        60.0,
+        config=True,
+        help="Interval in seconds between refreshes of the node image index.",
+    )
+
+    image_locality_fallback_timeout = Float(
+        10.0,
+        config=True,
+        help="""
+        Seconds a pinned task may stay pending before the pin is removed,
+        unless `image_locality` is `strict`.
+        """,
+    )
+
+    # credentials logged in to the Docker API client, keyed by registry URL
+    _registry_logins = {}
+    _registry_login_lock = None
+
     def __init__(self, *args, **kwargs):
         self._course_image = None
+        self._provisioned_dirs = None
 
         super().__init__(*args, **kwargs)
 
         self._registry = get_registry(config=self.config)
 
+        self._warm_pool = None
+        self._warm_service = None
+        if self.warm_pool_sizes:
+            self._warm_pool = WarmPool._instance
+            if self._warm_pool is None:
+                self._warm_pool = WarmPool.instance(
+                    docker=DockerAPI.for_spawner(self),
+                    sizes={
+                        self._registry.get_full_image_name(name): size
+                        for name, size in self.warm_pool_sizes.items()
+                    },
+                    network_name=self.network_name,
+                    placement=self._get_warm_pool_placement(),
+                    refill_interval=self.warm_pool_refill_interval,
+                    auth=self._get_registry_auth(),
+                    log=self.log)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                self._warm_pool.start()
+
+        self._locality = None
+        self._locality_pin = None
+        if self.image_locality != 'off':
+            self._locality = ImageLocality._instance
+            if self._locality is None:
+                self._locality = ImageLocality.instance(
+                    docker=DockerAPI.for_spawner(self),
+                    refresh_interval=self.image_locality_refresh_interval,
+                    log=self.log)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                self._locality.start()
+
     @property
     def course_dir(self):
         course_dir = self.name
@@ -131,6 +312,23 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
     def course_image(self, value):
         self._course_image = value
 
+    def load_state(self, state):
+        super().load_state(state)
+        self._provisioned_dirs = state.get('provisioned_dirs')
+
+    def clear_state(self):
+        super().clear_state()
+        if not self.object_id:
+            # the service is gone; do not reuse the name of a warm pool
+            # service for the next spawn
+            self.object_name = self._object_name_default()
+
+    def get_state(self):
+        state = super().get_state()
+        if self._provisioned_dirs:
+            state['provisioned_dirs'] = self._provisioned_dirs
+        return state
+
     def template_namespace(self):
         d = super().template_namespace()
 
@@ -143,11 +341,14 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
         """
         Override the default form to handle the case when there is only one image.
         """
-        images = await self._registry.list_images()
-        image_dict = {i['image_name']: i for i in images}
+        with time_phase(self, SpawnPhase.options_form):
+            return await self._get_options_form()
+
+    async def _get_options_form(self):
+        images = await self._registry.get_spawnable_images()
 
         if not self.user.admin:
-            if self.course_image and self.course_image in image_dict:
+            if self.course_image and self.course_image in images:
                 self.image = self._registry.get_full_image_name(self.course_image)
             else:
                 self._use_default_course_image(images)
@@ -157,35 +358,27 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
             self._use_initial_course_image(images)
             return ''
 
-        for i in images:
-            if self.course_image and self.course_image in image_dict:
-                i['selected'] = (i['image_name'] == self.course_image)
-            else:
-                i['selected'] = i['default_course_image']
+        if self.course_image and self.course_image in images:
+            selected = self.course_image
+        elif images.default is not None:
+            selected = images.default.image_name
+        else:
+            selected = None
 
-        image_form_template = Environment(loader=BaseLoader).from_string(
-            self.image_form_template
-        )
-        return image_form_template.render(image_list=images, registry_host=self._registry.host)
+        return _render_image_form(
+            self.image_form_template, images, self._registry.host, selected)
 
     async def check_allowed(self, image):
-        images = await self._registry.list_images()
+        images = await self._registry.get_spawnable_images()
 
-        registry_host = self._registry.host
-        image_names = [
-            f'{registry_host}/{image["image_name"]}'
-            for image in images
-        ]
-
-        if image not in image_names:
+        if not images.is_allowed(image):
             raise web.HTTPError(400, "Specifying image to launch is not allowed")
         return image
 
     def _use_default_course_image(self, images):
         self.image = self._registry.get_default_course_image()
 
-        default_course_images = [i for i in images if i['default_course_image']]
-        if not default_course_images:
+        if images.default is None:
             self._use_initial_course_image(images)
             return
 
@@ -193,11 +386,10 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
 
         self.image = self._registry.get_initial_course_image()
 
-        initial_course_images = [i for i in images if i['initial_course_image']]
-        if not initial_course_images:
+        if images.initial is None:
             raise RuntimeError("Initial course image NOT found")
 
-    async def _get_cmd_from_image(self):
+    async def _get_image_config(self):
         parts = self.image.split('/', 1)
         if len(parts) == 2:
             host, image_name = parts
@@ -205,13 +397,28 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
             host, image_name = ('', parts[0])
 
         if host == self._registry.host:
-            name, ref = split_image_name(image_name)
-            config = await self._registry.inspect_image(name, ref)
-            cmd = config['data']['config']['Cmd']
-        else:
+            images = await self._registry.get_spawnable_images()
+            config = images.get_config(image_name)
+            if config is None:
+                name, ref = split_image_name(image_name)
+                data = await self._registry.inspect_image(name, ref)
+                config = ImageConfig.from_config(data['data']['config'])
+            return config
+
+        # a tag may be moved to another image, so it is never cached
+        key = _local_image_config_key(self.image)
+        config = _get_local_image_config(key) if key else None
+        if config is None:
             image_info = await self.docker("inspect_image", self.image)
-            cmd = image_info["Config"]["Cmd"]
-        return cmd
+            config = ImageConfig.from_config(image_info["Config"])
+            _put_local_image_config(image_info["Id"], config)
+            if key:
+                _put_local_image_config(key, config)
+        return config
+
+    async def _get_cmd_from_image(self):
+        config = await self._get_image_config()
+        return config.cmd
 
     def get_args(self):
         args = super().get_args()
@@ -249,20 +456,31 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
         ))
         return env
 
-    def _make_user_dirs(self):
-        if self.course_dir:
-            return
-
+    def _get_home_dirs(self):
+        """
+        Return the directories to create in the user's home directory,
+        owned by the owner of the home directory, with their modes.
+        """
         home_dir = os.path.join(self.users_dir, self.user.name)
+        base_dir = home_dir
         dirs = []
+        if self.course_dir:
+            base_dir = os.path.join(home_dir, self.course_dir)
+            dirs.append((base_dir, 0o755))
         if self.user.admin:
             dirs.extend([
-                (os.path.join(home_dir, 'textbook'), 0o777),
-                (os.path.join(home_dir, 'info'), 0o777)
+                (os.path.join(base_dir, 'textbook'), 0o777),
+                (os.path.join(base_dir, 'info'), 0o777)
             ])
+        return dirs
 
+    def _make_user_dirs(self):
+        if self.course_dir:
+            return
+
+        home_dir = os.path.join(self.users_dir, self.user.name)
         statinfo = os.stat(home_dir)
-        for dirpath, mode in dirs:
+        for dirpath, mode in self._get_home_dirs():
             self._make_dir(dirpath, mode, statinfo.st_uid, statinfo.st_gid)
 
     def _make_user_course_dirs(self):
@@ -274,17 +492,7 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
             os.path.join(self.admin_data_dir, 'info', self.course_dir)
         ]
 
-        home_dir = os.path.join(self.users_dir, self.user.name)
-        course_dirs = [
-            (os.path.join(home_dir, self.course_dir), 0o755)
-        ]
-
         if self.user.admin:
-            course_dirs.extend([
-                (os.path.join(home_dir, self.course_dir, 'textbook'), 0o777),
-                (os.path.join(home_dir, self.course_dir, 'info'), 0o777)
-            ])
-
             for dirpath in content_dirs:
                 self._make_dir(dirpath, 0o777, 0, 0)
         else:
@@ -294,17 +502,74 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
                     'You are not permitted to create a new course, "%s".',
                     self.course_dir)
 
+        home_dir = os.path.join(self.users_dir, self.user.name)
         statinfo = os.stat(home_dir)
-        for dirpath, mode in course_dirs:
+        for dirpath, mode in self._get_home_dirs():
             self._make_dir(dirpath, mode, statinfo.st_uid, statinfo.st_gid)
 
     def _make_dir(self, dirpath, mode, uid, gid):
         try:
-            os.mkdir(dirpath)
-        except FileExistsError:
-            pass
-        os.chmod(dirpath, mode)
-        os.chown(dirpath, uid, gid)
+            statinfo = os.stat(dirpath)
+        except FileNotFoundError:
+            try:
+                os.mkdir(dirpath)
+            except FileExistsError:
+                pass
+            statinfo = os.stat(dirpath)
+        if stat.S_IMODE(statinfo.st_mode) != mode:
+            os.chmod(dirpath, mode)
+        if statinfo.st_uid != uid or statinfo.st_gid != gid:
+            os.chown(dirpath, uid, gid)
+
+    def _dirs_provisioned(self):
+        """
+        Check whether the user's directories exist with the modes and
+        owners that `_make_dir` would set, without changing them.
+        """
+        home_dir = os.path.join(self.users_dir, self.user.name)
+        try:
+            home = os.stat(home_dir)
+            dirs = [(dirpath, mode, home.st_uid, home.st_gid)
+                    for dirpath, mode in self._get_home_dirs()]
+            if self.course_dir and self.user.admin:
+                dirs.extend(
+                    (os.path.join(self.admin_data_dir, d, self.course_dir),
+                     0o777, 0, 0)
+                    for d in ('textbook', 'info'))
+            for dirpath, mode, uid, gid in dirs:
+                statinfo = os.stat(dirpath)
+                if (not stat.S_ISDIR(statinfo.st_mode) or
+                        stat.S_IMODE(statinfo.st_mode) != mode or
+                        statinfo.st_uid != uid or statinfo.st_gid != gid):
+                    return False
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _run_in_dir_executor(self, func, *args):
+        cls = self.__class__
+        if cls._dir_executor is None:
+            cls._dir_executor = ThreadPoolExecutor(
+                self.dir_provision_threads,
+                thread_name_prefix='cwh-dirs')
+        return asyncio.get_running_loop().run_in_executor(
+            cls._dir_executor, func, *args)
+
+    async def _provision_dirs(self):
+        """
+        Create the user's directories unless they were already created
+        for the same course and role.
+        """
+        marker = '{}:{}:{}:{}'.format(
+            self.users_dir, self.admin_data_dir, self.course_dir,
+            'admin' if self.user.admin else 'user')
+        if (self._provisioned_dirs == marker and
+                await self._run_in_dir_executor(self._dirs_provisioned)):
+            return
+
+        await self._run_in_dir_executor(self._make_user_dirs)
+        await self._run_in_dir_executor(self._make_user_course_dirs)
+        self._provisioned_dirs = marker
 
     async def create_object(self, *args, **kwargs):
         server_name = self.name
@@ -318,15 +583,163 @@ class Repo2DockerSpawner(CoursewareUserSpawner):
                 f" workdir={workdir}"
                 f" image='{self.image}'")
 
-        self._make_user_dirs()
-        self._make_user_course_dirs()
-
-        self.docker(
-            'login',
+        with time_phase(self, SpawnPhase.provision_dirs):
+            await self._provision_dirs()
+
+        with time_phase(self, SpawnPhase.registry_login):
+            await self._login_registry()
+
+        self._locality_pin = await self._get_locality_pin()
+
+        if self._warm_pool is not None and self._resume_service is None:
+            service = await self._warm_pool.claim(self.image)
+            if service is not None:
+                self._warm_service = service
+                self.object_name = service['Spec']['Name']
+                try:
+                    created = await self._create_service(*args, **kwargs)
+                except Exception:
+                    self.log.warning(
+                        'failed to bind warm pool service %s,'
+                        ' falling back to a new service',
+                        self.object_name, exc_info=True)
+                    self._warm_service = None
+                    self.object_name = self._object_name_default()
+                    await self._warm_pool.discard(service)
+                else:
+                    node_id = created.get('NodeID')
+                    self._locality_pin = (
+                        f'node.id=={node_id}' if node_id else None)
+                    return created
+
+        return await self._create_service(*args, **kwargs)
+
+    async def _get_locality_pin(self):
+        if self._locality is None:
+            return None
+        digest = None
+        host, _, image_name = self.image.partition('/')
+        if host == self._registry.host:
+            images = await self._registry.get_spawnable_images()
+            image = images.get(image_name)
+            if image is not None:
+                digest = image.manifest_digest
+        try:
+            node_id = await self._locality.choose_node(
+                self.image, digest, prefer=self._suspended_node)
+        except Exception:
+            self.log.warning('failed to look up nodes holding %s',
+                             self.image, exc_info=True)
+            return None
+        if node_id is None:
+            return None
+        self._locality.add(node_id)
+        self.log.debug('placing %s on node %s holding %s',
+                       self.service_name, node_id, self.image)
+        return f'node.id=={node_id}'
+
+    def _add_locality_pin(self, task_template):
+        placement = task_template.get('Placement') or {}
+        constraints = list(placement.get('Constraints') or [])
+        constraints.append(self._locality_pin)
+        task_template['Placement'] = dict(placement, Constraints=constraints)
+
+    async def start_object(self):
+        pin, self._locality_pin = self._locality_pin, None
+        if pin is not None and self.image_locality != 'strict':
+            await self._wait_for_pinned_task(pin)
+        return await super().start_object()
+
+    async def _wait_for_pinned_task(self, pin):
+        """
+        Remove the node pin if the task cannot be scheduled on the node.
+        """
+        deadline = time.monotonic() + self.image_locality_fallback_timeout
+        while True:
+            task = await self.get_task()
+            if task is None or task['Status']['State'] != 'pending':
+                return
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(1)
+
+        self.log.info('unpinning %s from %s: %s', self.service_name, pin,
+                      task['Status'].get('Err', 'pending'))
+        service = await self.docker('inspect_service', self.service_id)
+        task_template = service['Spec']['TaskTemplate']
+        placement = task_template.get('Placement') or {}
+        placement['Constraints'] = [
+            c for c in placement.get('Constraints') or [] if c != pin]
+        task_template['Placement'] = placement
+        await self.docker(
+            'update_service',
+            service['ID'],
+            service['Version']['Index'],
+            task_template=task_template,
+            fetch_current_spec=True)
+        self._invalidate_snapshot()
+
+    def _get_warm_pool_placement(self):
+        placement = self.extra_task_spec.get('placement')
+        if placement is None and self.extra_placement_spec:
+            placement = Placement(**self.extra_placement_spec)
+        return placement
+
+    async def _create_service(self, *args, **kwargs):
+        try:
+            return await super().create_object(*args, **kwargs)
+        except APIError as e:
+            if e.status_code != 401:
+                raise
+            self.log.warning('registry authentication failed: %s', e)
+            await self._login_registry(reauth=True)
+            return await super().create_object(*args, **kwargs)
+
+    def docker(self, method, *args, **kwargs):
+        if method == 'create_service' and self._locality_pin is not None:
+            self._add_locality_pin(kwargs['task_template'])
+        if method == 'create_service' and self._warm_service is not None:
+            # bind the claimed warm pool service instead of creating one
+            service, self._warm_service = self._warm_service, None
+            return asyncio.ensure_future(
+                self._warm_pool.bind(service, **kwargs))
+        return super().docker(method, *args, **kwargs)
+
+    def _get_registry_auth(self):
+        """
+        Return the `login` arguments for the registry, or None.
+        """
+        if not self._registry.username:
+            return None
+        return dict(
             username=self._registry.username,
             password=self._registry.password,
             registry=self._registry.get_registry_url())
-        return await super().create_object(*args, **kwargs)
+
+    async def _login_registry(self, reauth=False):
+        """
+        Log in to the registry once per process.
+
+        The Docker API client keeps the credentials and sends them
+        as X-Registry-Auth when it creates a service.
+        """
+        auth = self._get_registry_auth()
+        if auth is None:
+            return
+        registry_url = auth['registry']
+        credentials = (auth['username'], auth['password'])
+
+        cls = self.__class__
+        if cls._registry_login_lock is None:
+            cls._registry_login_lock = asyncio.Lock()
+        if not reauth and cls._registry_logins.get(registry_url) == credentials:
+            return
+        async with cls._registry_login_lock:
+            if (not reauth and
+                    cls._registry_logins.get(registry_url) == credentials):
+                return
+            await self.docker('login', reauth=True, **auth)
+            cls._registry_logins[registry_url] = credentials
 
 
 def cwh_repo2docker_jupyterhub_config(
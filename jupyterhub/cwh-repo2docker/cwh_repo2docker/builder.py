@@ -1,16 +1,56 @@
+import asyncio
 import json
 import re
 
+import aiohttp
 from aiodocker import Docker, DockerError
 from jupyterhub.services.auth import HubOAuthenticated
 from tornado import web
+from tornado.log import app_log
 
-from .docker import build_image
+from .docker import build_image, wait_build
+from .prepull import get_prepuller
 from .registry import get_registry, split_image_name
 from .base import BaseHandler
 
 IMAGE_NAME_RE = r"^[a-z0-9-_]+$"
 
+# keep references to background tasks until they finish
+_background_tasks = set()
+
+
+def _prepull_image(config, registry, image_name):
+    auth = None
+    if registry.username:
+        auth = {
+            "username": registry.username,
+            "password": registry.password,
+            "serveraddress": registry.host,
+        }
+    get_prepuller(config=config).prepull(
+        registry.get_full_image_name(image_name), auth)
+
+
+async def _invalidate_catalog_after_build(config, registry, image_name):
+    try:
+        succeeded = await wait_build(image_name)
+    finally:
+        registry.invalidate_catalog()
+
+    # an older image of the same name may still be in the registry
+    if not succeeded:
+        app_log.info('not pre-pulling %s: the build %s', image_name,
+                     'failed' if succeeded is False else 'result is unknown')
+        return
+
+    try:
+        image = await registry.inspect_image(*split_image_name(image_name))
+    except aiohttp.ClientResponseError as e:
+        app_log.warning('failed to look up %s: %s', image_name, e)
+        return
+    if image is not None:
+        _prepull_image(config, registry, image_name)
+
 
 class BuildHandler(HubOAuthenticated, BaseHandler):
     """
@@ -19,10 +59,70 @@ class BuildHandler(HubOAuthenticated, BaseHandler):
 
     @web.authenticated
     async def delete(self):
+        """
+        Delete an image given by `name`, or the images given by `names`.
+
+        For `names`, the response lists the result of each image.  An image
+        that is already absent is deleted.  The status is 200 if all images
+        were deleted, 207 if some were, and 500 if none were.
+        """
         data = self.get_json_body()
-        name = data["name"]
+        if "names" not in data:
+            await self._delete_one(data["name"])
+            return
+
+        names = data["names"]
+        if not isinstance(names, list) or not names:
+            raise web.HTTPError(400, "No environments to delete")
 
         registry = get_registry(config=self.settings['config'])
+        errors = await registry.delete_images(
+            [split_image_name(name) for name in names])
+
+        async with Docker() as docker:
+            async def delete_local_image(name, error):
+                # the image may be left locally if it is not in the registry
+                if error is not None and not isinstance(error, LookupError):
+                    return error
+                try:
+                    await docker.images.delete(f"{registry.host}/{name}")
+                except DockerError as e:
+                    if e.status != 404:
+                        return e
+                return None
+
+            errors = await asyncio.gather(*[
+                delete_local_image(name, error)
+                for name, error in zip(names, errors)
+            ])
+
+        results = []
+        for name, error in zip(names, errors):
+            if error is None:
+                results.append({"name": name, "status": "ok"})
+            else:
+                self.log.warning('failed to delete %s: %s', name, error)
+                results.append({
+                    "name": name,
+                    "status": "error",
+                    "message": getattr(error, 'message', None) or str(error)
+                })
+
+        failed = sum(error is not None for error in errors)
+        if not failed:
+            self.set_status(200)
+        elif failed < len(errors):
+            self.set_status(207)
+        else:
+            self.set_status(500)
+        self.set_header('content-type', 'application/json')
+        self.finish(json.dumps({
+            "status": "error" if failed else "ok",
+            "results": results
+        }))
+
+    async def _delete_one(self, name):
+        registry = get_registry(config=self.settings['config'])
 
         local_image_name = f"{registry.host}/{name}"
         image_name, ref = split_image_name(name)
@@ -70,7 +170,14 @@ class BuildHandler(HubOAuthenticated, BaseHandler):
 
         registry = get_registry(config=self.settings['config'])
 
-        await build_image(registry.host, repo, ref, name, username, password, extra_buildargs)
+        image_name = await build_image(registry.host, repo, ref, name, username, password, extra_buildargs)
+        registry.add_course_repository(split_image_name(image_name)[0])
+
+        task = asyncio.ensure_future(
+            _invalidate_catalog_after_build(
+                self.settings['config'], registry, image_name))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
         self.set_status(200)
         self.set_header('content-type', 'application/json')
@@ -92,7 +199,35 @@ class DefaultCourseImageHandler(HubOAuthenticated, BaseHandler):
 
         registry = get_registry(config=self.settings['config'])
         await registry.set_default_course_image(repo, digest)
+        _prepull_image(
+            self.settings['config'], registry, registry.default_course_image)
 
         self.set_status(200)
         self.set_header('content-type', 'application/json')
         self.finish(json.dumps({"status": "ok"}))
+
+
+class PrePullHandler(HubOAuthenticated, BaseHandler):
+    """
+    Handler to pull environments on the swarm nodes and report the progress
+    """
+
+    @web.authenticated
+    async def get(self):
+        prepuller = get_prepuller(config=self.settings['config'])
+
+        self.set_status(200)
+        self.set_header('content-type', 'application/json')
+        self.finish(json.dumps({"prepulls": prepuller.status()}))
+
+    @web.authenticated
+    async def post(self):
+        data = self.get_json_body()
+        name = data["name"]
+
+        registry = get_registry(config=self.settings['config'])
+        _prepull_image(self.settings['config'], registry, name)
+
+        self.set_status(202)
+        self.set_header('content-type', 'application/json')
+        self.finish(json.dumps({"status": "ok"}))
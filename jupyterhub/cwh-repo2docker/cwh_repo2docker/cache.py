@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from typing import (
+    Dict,
+    Optional
+)
+
+from tornado.log import app_log
+
+
+DIGEST_RE = re.compile(r'^[a-z0-9]+(?:[.+_-][a-z0-9]+)*:[a-zA-Z0-9=_-]+$')
+
+
+def verify_digest(data: bytes, digest: str) -> bool:
+    """
+    Check that `data` matches a `sha256:<hex>` content digest.
+    Digests using other algorithms are not verified.
+    """
+    algorithm, _, value = digest.partition(':')
+    if algorithm != 'sha256':
+        return True
+    return hashlib.sha256(data).hexdigest() == value
+
+
+class DigestCache:
+    """
+    Bounded LRU cache of parsed JSON documents keyed by content digest.
+
+    Because the documents are content-addressed, cached entries never
+    become stale.  If `directory` is set, entries are also written there
+    and read back after they are evicted from memory or the process restarts.
+    """
+
+    def __init__(
+            self,
+            max_entries: int,
+            directory: Optional[str] = None,
+            log=None):
+        self.max_entries = max_entries
+        self.directory = directory or None
+        self.log = log or app_log
+        self._entries = OrderedDict()
+
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                self.log.warning('failed to create cache directory %s: %s;'
+                                 ' caching in memory only',
+                                 self.directory, e)
+                self.directory = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, digest: str) -> Optional[Dict]:
+        data = self._entries.get(digest)
+        if data is not None:
+            self._entries.move_to_end(digest)
+            return data
+
+        data = self._load(digest)
+        if data is not None:
+            self._remember(digest, data)
+        return data
+
+    def put(self, digest: str, data: Dict) -> None:
+        self._remember(digest, data)
+        self._store(digest, data)
+
+    def _remember(self, digest: str, data: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[digest] = data
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, digest: str) -> Optional[str]:
+        if self.directory is None or not DIGEST_RE.match(digest):
+            return None
+        return os.path.join(self.directory, digest.replace(':', '-') + '.json')
+
+    def _load(self, digest: str) -> Optional[Dict]:
+        path = self._path(digest)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.log.warning('failed to read cache file %s: %s', path, e)
+            return None
+
+    def _store(self, digest: str, data: Dict) -> None:
+        path = self._path(digest)
+        if path is None:
+            return
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.log.warning('failed to write cache file %s: %s', path, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
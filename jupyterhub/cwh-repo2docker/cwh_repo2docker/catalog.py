@@ -0,0 +1,115 @@
+from typing import (
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional
+)
+
+
+class ImageConfig(NamedTuple):
+    cmd: Optional[List[str]]
+    entrypoint: Optional[List[str]]
+    labels: Dict[str, str]
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'ImageConfig':
+        """
+        Build from the `config` section of an image configuration, which
+        is also the `Config` section of `docker inspect`.
+        """
+        config = config or {}
+        return cls(
+            cmd=config.get('Cmd'),
+            entrypoint=config.get('Entrypoint'),
+            labels=config.get('Labels') or {},
+        )
+
+
+class SpawnableImage(NamedTuple):
+    image_name: str
+    display_name: str
+    repo: Optional[str]
+    ref: Optional[str]
+    image_id: str
+    manifest_digest: str
+    default_course_image: bool
+    initial_course_image: bool
+
+
+class SpawnableImages:
+    """
+    Compact view of the course images that users can spawn.
+
+    The view is built from the `Registry.list_images` result and shared by
+    all spawners until the catalog generation changes, so that it must not
+    be modified.
+    """
+
+    def __init__(
+            self,
+            images: List[Dict],
+            generation: int,
+            host: str):
+        self.generation = generation
+        self.host = host
+        self.images = tuple(
+            SpawnableImage(
+                image_name=i['image_name'],
+                display_name=i['display_name'],
+                repo=i['repo'],
+                ref=i['ref'],
+                image_id=i['image_id'],
+                manifest_digest=i['manifest_digest'],
+                default_course_image=i['default_course_image'],
+                initial_course_image=i['initial_course_image'],
+            )
+            for i in images
+        )
+        self._by_name = {i.image_name: i for i in self.images}
+        self._configs = {}
+        for i, image in zip(images, self.images):
+            config = ImageConfig.from_config(
+                i.get('config', {}).get('config'))
+            repo = image.image_name.rsplit(':', 1)[0]
+            self._configs[image.image_name] = config
+            self._configs[f'{repo}@{image.manifest_digest}'] = config
+        self.default = next(
+            (i for i in self.images if i.default_course_image), None)
+        self.initial = next(
+            (i for i in self.images if i.initial_course_image), None)
+        self.allowed = self._allowed_names()
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __iter__(self):
+        return iter(self.images)
+
+    def __contains__(self, image_name: str) -> bool:
+        return image_name in self._by_name
+
+    def get(self, image_name: str) -> Optional[SpawnableImage]:
+        return self._by_name.get(image_name)
+
+    def get_config(self, image_name: str) -> Optional[ImageConfig]:
+        """
+        Return the configuration of an image named as `name:tag`
+        or `name@digest`.
+        """
+        return self._configs.get(image_name)
+
+    def is_allowed(self, image: str) -> bool:
+        """
+        Check whether `image` names one of the images, either as
+        `host/name:tag` or pinned as `host/name@digest`.
+        """
+        return image in self.allowed
+
+    def _allowed_names(self) -> FrozenSet[str]:
+        names = set()
+        for i in self.images:
+            repo = i.image_name.rsplit(':', 1)[0]
+            names.add(f'{self.host}/{i.image_name}')
+            names.add(f'{self.host}/{repo}@{i.manifest_digest}')
+        return frozenset(names)
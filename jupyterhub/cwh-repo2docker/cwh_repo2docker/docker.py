@@ -2,7 +2,7 @@ import json
 
 from urllib.parse import urlparse
 
-from aiodocker import Docker
+from aiodocker import Docker, DockerError
 
 
 async def list_containers():
@@ -117,3 +117,31 @@ async def build_image(
 
     async with Docker() as docker:
         await docker.containers.run(config=config)
+
+    return image_name
+
+
+async def wait_build(image_name):
+    """
+    Wait until the repo2docker container building the image exits.
+
+    Returns True if the build succeeded, False if it failed, or None if
+    the container had already been removed.
+    """
+    succeeded = None
+    async with Docker() as docker:
+        containers = await docker.containers.list(
+            filters=json.dumps({"label": [f"repo2docker.build={image_name}"]})
+        )
+        for container in containers:
+            try:
+                result = await container.wait()
+            except DockerError as e:
+                # the container has already been removed
+                if e.status != 404:
+                    raise
+                continue
+            if result.get("StatusCode") != 0:
+                return False
+            succeeded = True
+    return succeeded
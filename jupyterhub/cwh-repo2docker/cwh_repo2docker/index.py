@@ -0,0 +1,256 @@
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set
+)
+
+from tornado.log import app_log
+
+
+def _write_json(path: str, data: Dict) -> None:
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class RepositoryIndex:
+    """
+    Names of the registry repositories known to hold course images.
+
+    The hub and the environments service share the index through a JSON
+    file, so that repositories added by a build in the service are listed
+    by the hub without scanning the whole registry.
+    """
+
+    def __init__(self, path: Optional[str] = None, log=None):
+        self.path = path
+        self.log = log or app_log
+        self.reconciled_at = 0.0
+        self._repositories = {}
+        self._mtime = None
+        self.reload()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._repositories
+
+    def names(self) -> Set[str]:
+        return set(self._repositories)
+
+    def reload(self) -> None:
+        """
+        Read the index file again if it was changed by another process.
+        """
+        if self.path is None:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log.warning('failed to read repository index %s: %s',
+                             self.path, e)
+            return
+        self._mtime = mtime
+        self._repositories = dict(data.get('repositories', {}))
+        self.reconciled_at = data.get('reconciled_at', 0.0)
+
+    def add(self, names: Iterable[str]) -> None:
+        """
+        Add repositories, e.g. when an image is built or tagged.
+        """
+        self.reload()
+        now = time.time()
+        added = False
+        for name in names:
+            if name not in self._repositories:
+                self._repositories[name] = now
+                added = True
+        if added:
+            self._save()
+
+    def reconcile(self, names: Iterable[str], started_at: float) -> None:
+        """
+        Replace the index with the result of a full registry scan
+        that started at `started_at`.
+
+        Repositories added by other processes during the scan are kept.
+        """
+        self.reload()
+        repositories = {
+            name: added_at
+            for name, added_at in self._repositories.items()
+            if added_at >= started_at
+        }
+        for name in names:
+            repositories.setdefault(name, self._repositories.get(name, started_at))
+        self._repositories = repositories
+        self.reconciled_at = started_at
+        self._save()
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        try:
+            _write_json(self.path, {
+                'repositories': self._repositories,
+                'reconciled_at': self.reconciled_at
+            })
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            self.log.warning('failed to write repository index %s: %s',
+                             self.path, e)
+
+
+class CatalogStamp:
+    """
+    Marker of the last invalidation of the image catalog.
+
+    The hub and the environments service share the marker through a file,
+    so that an image built or deleted by one process is not hidden by the
+    catalog cached by the other.
+    """
+
+    def __init__(self, path: Optional[str] = None, log=None):
+        self.path = path
+        self.log = log or app_log
+        self._mtime = None
+        self._mtime = self._stat()
+
+    def changed(self) -> bool:
+        """
+        Whether another process invalidated the catalog since the last call.
+        """
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        return True
+
+    def touch(self) -> None:
+        """
+        Invalidate the catalog of every process sharing the marker.
+        """
+        if self.path is None:
+            return
+        try:
+            _write_json(self.path, {'invalidated_at': time.time()})
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            self.log.warning('failed to write catalog stamp %s: %s',
+                             self.path, e)
+
+    def _stat(self) -> Optional[int]:
+        if self.path is None:
+            return None
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            self.log.warning('failed to read catalog stamp %s: %s',
+                             self.path, e)
+            return self._mtime
+
+
+class LayerIndex:
+    """
+    Blobs referenced by the manifests of each repository,
+    with the number of manifests referencing each blob.
+
+    A registry deletes blobs per repository, so a blob of a repository can
+    be deleted once no other manifest of the same repository references it.
+    """
+
+    def __init__(self, path: Optional[str] = None, log=None):
+        self.path = path
+        self.log = log or app_log
+        self._manifests = {}
+        self._refcounts = {}
+        self._dirty = False
+        self._load()
+
+    def get(self, repo: str, manifest_digest: str) -> Optional[List[str]]:
+        return self._manifests.get(repo, {}).get(manifest_digest)
+
+    def digests(self, repo: str) -> Set[str]:
+        return set(self._manifests.get(repo, {}))
+
+    def add(self, repo: str, manifest_digest: str, blobs: List[str]) -> None:
+        manifests = self._manifests.setdefault(repo, {})
+        if manifest_digest in manifests:
+            return
+        blobs = sorted(set(blobs))
+        manifests[manifest_digest] = blobs
+        refcounts = self._refcounts.setdefault(repo, Counter())
+        refcounts.update(blobs)
+        self._dirty = True
+
+    def remove(self, repo: str, manifest_digest: str) -> List[str]:
+        """
+        Forget a manifest and return its blobs that are no longer
+        referenced by any other manifest of the repository.
+        """
+        blobs = self._manifests.get(repo, {}).pop(manifest_digest, None)
+        if blobs is None:
+            return []
+        refcounts = self._refcounts[repo]
+        unreferenced = []
+        for blob in blobs:
+            refcounts[blob] -= 1
+            if refcounts[blob] <= 0:
+                del refcounts[blob]
+                unreferenced.append(blob)
+        self._dirty = True
+        return unreferenced
+
+    def sync(self, repo: str, manifest_digests: Iterable[str]) -> None:
+        """
+        Forget manifests of the repository that are no longer tagged.
+        """
+        for manifest_digest in self.digests(repo) - set(manifest_digests):
+            self.remove(repo, manifest_digest)
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        try:
+            _write_json(self.path, {'manifests': self._manifests})
+            self._dirty = False
+        except OSError as e:
+            self.log.warning('failed to write layer index %s: %s',
+                             self.path, e)
+
+    def _load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log.warning('failed to read layer index %s: %s',
+                             self.path, e)
+            return
+        for repo, manifests in data.get('manifests', {}).items():
+            for manifest_digest, blobs in manifests.items():
+                self.add(repo, manifest_digest, blobs)
+        self._dirty = False
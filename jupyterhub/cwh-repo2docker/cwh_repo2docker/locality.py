@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+from tornado.log import app_log
+
+
+def split_digest(image):
+    """
+    Split `name:tag@digest` into `name:tag` and the digest, or None.
+    """
+    name, _, digest = image.partition('@')
+    return name, (digest or None)
+
+
+class ImageLocality:
+    """
+    Index of the swarm nodes that hold course images.
+
+    The index is built from the tasks of all services.  A node holds
+    the image of a task once a container of the task was created there.
+    Swarm pins the image of a task to its digest, so nodes are indexed
+    by the image digest and by the image name as a fallback for
+    nodes that hold an older build of the image.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def __init__(self, docker, refresh_interval=60.0, log=None):
+        self.docker = docker
+        self.refresh_interval = refresh_interval
+        self.log = log or app_log
+        self._by_digest = {}
+        self._by_name = {}
+        self._load = {}
+        self._refreshed = None
+        self._refresh_lock = None
+        self._refresh_task = None
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                self.log.exception('failed to refresh image locality index')
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self):
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            nodes = await self.docker('nodes')
+            tasks = await self.docker('tasks')
+
+            available = {
+                node['ID'] for node in nodes
+                if node.get('Status', {}).get('State') == 'ready'
+                and node.get('Spec', {}).get('Availability') == 'active'
+            }
+            by_digest = {}
+            by_name = {}
+            load = {node_id: 0 for node_id in available}
+            for task in tasks:
+                node_id = task.get('NodeID')
+                if node_id not in available:
+                    continue
+                status = task.get('Status', {})
+                if status.get('State') == 'running':
+                    load[node_id] += 1
+                if not status.get('ContainerStatus', {}).get('ContainerID'):
+                    continue
+                image = task['Spec']['ContainerSpec']['Image']
+                name, digest = split_digest(image)
+                by_name.setdefault(name, set()).add(node_id)
+                if digest:
+                    by_digest.setdefault(digest, set()).add(node_id)
+
+            self._by_digest = by_digest
+            self._by_name = by_name
+            self._load = load
+            self._refreshed = time.monotonic()
+            self.log.debug('image locality index: %d images on %d nodes',
+                           len(by_name), len(available))
+
+    def nodes_for(self, image, digest=None):
+        """
+        Return the IDs of the available nodes that hold `image`.
+        """
+        name, pinned = split_digest(image)
+        digest = pinned or digest
+        nodes = self._by_digest.get(digest) if digest else None
+        if not nodes:
+            nodes = self._by_name.get(name)
+        return set(nodes or ())
+
+    async def choose_node(self, image, digest=None, prefer=None):
+        """
+        Return the ID of the least loaded node that holds `image`,
+        or None if no available node holds it.
+
+        The node `prefer` is chosen if it holds the image.
+        """
+        if self._refreshed is None:
+            await self.refresh()
+        nodes = self.nodes_for(image, digest)
+        if not nodes:
+            return None
+        if prefer in nodes:
+            return prefer
+        return min(nodes, key=lambda n: (self._load.get(n, 0), n))
+
+    def add(self, node_id):
+        """
+        Count a task placed on `node_id` until the next refresh.
+        """
+        if node_id in self._load:
+            self._load[node_id] += 1
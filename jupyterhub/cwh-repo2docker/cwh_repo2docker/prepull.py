@@ -0,0 +1,250 @@
+import asyncio
+import time
+import uuid
+from textwrap import dedent
+from typing import (
+    Dict,
+    List,
+    Optional
+)
+
+from aiodocker import Docker, DockerError
+from traitlets import (
+    Float,
+    Integer,
+    List as ListTrait,
+    Unicode
+)
+from traitlets.config import SingletonConfigurable
+
+
+PREPULL_LABEL = 'cwh_repo2docker.prepull'
+
+# task states after the image was pulled
+PULLED_STATES = {'starting', 'running', 'complete'}
+FINAL_STATES = {'complete', 'failed', 'shutdown', 'rejected', 'orphaned', 'remove'}
+
+
+def get_prepuller(*args, **kwargs):
+    return PrePuller.instance(*args, **kwargs)
+
+
+def _node_attribute(node: Dict, name: str) -> Optional[str]:
+    spec = node.get('Spec', {})
+    description = node.get('Description', {})
+    if name == 'node.id':
+        return node.get('ID')
+    if name == 'node.hostname':
+        return description.get('Hostname')
+    if name == 'node.role':
+        return spec.get('Role')
+    if name == 'node.platform.os':
+        return description.get('Platform', {}).get('OS')
+    if name == 'node.platform.arch':
+        return description.get('Platform', {}).get('Architecture')
+    if name.startswith('node.labels.'):
+        return spec.get('Labels', {}).get(name[len('node.labels.'):])
+    if name.startswith('engine.labels.'):
+        labels = description.get('Engine', {}).get('Labels', {})
+        return labels.get(name[len('engine.labels.'):])
+    raise KeyError(name)
+
+
+def match_constraint(node: Dict, constraint: str) -> bool:
+    """
+    Evaluate a Swarm placement constraint such as `node.role==worker`.
+
+    Constraints on unknown attributes are left to Swarm and match any node.
+    """
+    for op in ('==', '!='):
+        if op in constraint:
+            name, value = (s.strip() for s in constraint.split(op, 1))
+            break
+    else:
+        return True
+    try:
+        actual = _node_attribute(node, name)
+    except KeyError:
+        return True
+    return (actual == value) == (op == '==')
+
+
+class PrePuller(SingletonConfigurable):
+    """
+    Pull course images on every eligible swarm node ahead of spawns.
+
+    An image is pulled on a node by a one-shot service constrained to the
+    node, which runs `command` and is removed when its task finishes.
+    """
+
+    constraints = ListTrait(
+        Unicode(),
+        config=True,
+        help=dedent(
+            """
+            Placement constraints of single-user servers.
+            Images are pulled only on the nodes matching them.
+            """
+        )
+    )
+
+    concurrency = Integer(
+        4,
+        config=True,
+        help="Maximum number of nodes pulling an image at once."
+    )
+
+    timeout = Float(
+        1800,
+        config=True,
+        help="Timeout in seconds of a pull on a node."
+    )
+
+    command = ListTrait(
+        Unicode(),
+        ['true'],
+        config=True,
+        help="Command run by the pull service after the image is pulled."
+    )
+
+    max_jobs = Integer(
+        10,
+        config=True,
+        help="Number of finished pre-pulls kept for progress reporting."
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._jobs = {}
+        self._tasks = {}
+
+    def status(self) -> List[Dict]:
+        """
+        Return the progress of pre-pulls, most recent first.
+        """
+        jobs = sorted(self._jobs.values(),
+                      key=lambda j: j['started'], reverse=True)
+        return [dict(j, nodes=dict(j['nodes'])) for j in jobs]
+
+    def prepull(self, image: str, auth: Optional[Dict] = None) -> None:
+        """
+        Start pulling `image` on the nodes in the background,
+        unless a pre-pull of the image is already running.
+        """
+        task = self._tasks.get(image)
+        if task is not None and not task.done():
+            return
+        job = {
+            'image': image,
+            'started': time.time(),
+            'finished': None,
+            'nodes': {},
+        }
+        self._jobs[image] = job
+        self._prune_jobs()
+        task = asyncio.ensure_future(self._prepull(job, auth))
+        self._tasks[image] = task
+        task.add_done_callback(lambda t: self._tasks.pop(image, None))
+
+    def _prune_jobs(self) -> None:
+        finished = sorted(
+            (j for j in self._jobs.values() if j['finished'] is not None),
+            key=lambda j: j['started'])
+        for job in finished[:max(0, len(finished) - self.max_jobs)]:
+            del self._jobs[job['image']]
+
+    async def _prepull(self, job: Dict, auth: Optional[Dict]) -> None:
+        image = job['image']
+        try:
+            async with Docker() as docker:
+                nodes = await self._list_nodes(docker)
+                self.log.info('pre-pulling %s on %d nodes', image, len(nodes))
+                for node in nodes:
+                    job['nodes'][node['Description']['Hostname']] = 'waiting'
+
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def pull(node):
+                    async with semaphore:
+                        await self._pull_on_node(docker, node, job, auth)
+
+                await asyncio.gather(*[pull(node) for node in nodes])
+        except Exception:
+            self.log.exception('failed to pre-pull %s', image)
+        finally:
+            job['finished'] = time.time()
+            self.log.info('pre-pulled %s: %s', image, job['nodes'])
+
+    async def _list_nodes(self, docker: Docker) -> List[Dict]:
+        nodes = await docker.nodes.list()
+        return [
+            node for node in nodes
+            if node.get('Status', {}).get('State') == 'ready'
+            and node.get('Spec', {}).get('Availability') == 'active'
+            and all(match_constraint(node, c) for c in self.constraints)
+        ]
+
+    async def _pull_on_node(
+            self,
+            docker: Docker,
+            node: Dict,
+            job: Dict,
+            auth: Optional[Dict]) -> None:
+        image = job['image']
+        hostname = node['Description']['Hostname']
+        job['nodes'][hostname] = 'pulling'
+
+        task_template = {
+            'ContainerSpec': {
+                'Image': image,
+                'Command': list(self.command),
+            },
+            'RestartPolicy': {'Condition': 'none'},
+            'Placement': {
+                'Constraints': [f"node.id=={node['ID']}"] + list(self.constraints)
+            },
+        }
+        kwargs = {}
+        if auth:
+            kwargs = dict(auth=auth, registry=image.split('/', 1)[0])
+        name = 'cwh-prepull-{}'.format(uuid.uuid4().hex[:12])
+        service = await docker.services.create(
+            task_template,
+            name=name,
+            labels={PREPULL_LABEL: image},
+            **kwargs)
+
+        try:
+            state = await self._wait_task(docker, service['ID'])
+        except asyncio.TimeoutError:
+            state = 'timeout'
+        except DockerError as e:
+            state = f'error: {e.message}'
+        finally:
+            try:
+                await docker.services.delete(service['ID'])
+            except DockerError as e:
+                self.log.warning('failed to remove %s: %s', name, e)
+
+        job['nodes'][hostname] = 'done' if state in PULLED_STATES else state
+        self.log.debug('pre-pull %s on %s: %s', image, hostname, state)
+
+    async def _wait_task(self, docker: Docker, service_id: str) -> str:
+        deadline = time.monotonic() + self.timeout
+        delay = 1.0
+        while True:
+            tasks = await docker.tasks.list(filters={'service': service_id})
+            for task in tasks:
+                status = task.get('Status', {})
+                state = status.get('State')
+                if state in PULLED_STATES:
+                    return state
+                if state in FINAL_STATES:
+                    # a container that could not start was still pulled
+                    if status.get('ContainerStatus', {}).get('ContainerID'):
+                        return 'complete'
+                    return status.get('Err') or state
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 10)
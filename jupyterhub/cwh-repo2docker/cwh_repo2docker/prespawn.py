@@ -0,0 +1,466 @@
+"""
+A JupyterHub service that starts the course servers of a lecture's
+students shortly before the lecture, following a timetable.
+
+The timetable is a YAML file validated by `prespawn-schema.json`:
+
+    lead_time: 600          # seconds before the lecture (default)
+    cleanup_after: 1800     # seconds after the lecture start (default)
+    timezone: Asia/Tokyo    # of `time` (default: local time)
+    lectures:
+      - course: course-a    # named server
+        group: class-a      # hub group of the students
+        weekdays: [mon, thu]
+        time: "09:00"
+        image: course-a:latest   # optional, excluding registry host
+      - course: course-b
+        group: class-b
+        start: "2026-04-10T10:40:00+09:00"
+        lead_time: 900
+
+Unquoted timestamps are read as ISO 8601 strings like quoted ones.
+
+Servers are started through the hub REST API, spread over the lead time.
+Servers that were started but not used by `cleanup_after` are stopped.
+The lectures handled, the students whose servers were started for the
+current lecture, and the servers started are kept in `state_file`, if set,
+so that a restart of the service starts the servers of the remaining
+students only and does not forget to stop them.
+"""
+import asyncio
+import json
+import os
+import signal
+from datetime import date, datetime, time, timedelta
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple
+)
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+
+import yaml
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.ioloop import IOLoop
+from traitlets import Float, Integer, Unicode
+from traitlets.config import Application, catch_config_error
+
+from .registry import get_registry
+
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+class Lecture(NamedTuple):
+    course: str
+    group: str
+    start: datetime
+    lead_time: float
+    cleanup_after: float
+    image: Optional[str]
+
+
+LectureKey = Tuple[str, str, datetime]
+
+
+def _lecture_key(lecture: Lecture) -> LectureKey:
+    return (lecture.course, lecture.group, lecture.start)
+
+
+def _parse_time(value: str) -> time:
+    hour, minute = value.split(':')
+    return time(int(hour), int(minute))
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def load_schedule(stream) -> Dict:
+    """
+    Load a YAML timetable.
+
+    YAML loads unquoted timestamps as datetimes, which are converted to
+    the ISO 8601 strings of the schema.
+    """
+    schedule = yaml.load(stream, Loader=yaml.SafeLoader) or {}
+    lectures = schedule.get('lectures') if isinstance(schedule, dict) else None
+    for entry in lectures if isinstance(lectures, list) else []:
+        if isinstance(entry, dict) and isinstance(entry.get('start'), date):
+            entry['start'] = entry['start'].isoformat()
+    return schedule
+
+
+def lecture_starts(entry: Dict, now: datetime, tz) -> List[datetime]:
+    """
+    Return the start times of a timetable entry from the day before `now`
+    to the day after.
+    """
+    if 'start' in entry:
+        start = datetime.fromisoformat(entry['start'])
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=tz)
+        return [start]
+
+    at = _parse_time(entry['time'])
+    weekdays = [WEEKDAYS.index(d) for d in entry['weekdays']]
+    today = now.astimezone(tz).date()
+    starts = []
+    for days in (-1, 0, 1):
+        day = today + timedelta(days=days)
+        if day.weekday() in weekdays:
+            starts.append(datetime.combine(day, at, tzinfo=tz))
+    return starts
+
+
+class PreSpawnApplication(Application):
+
+    config_file = Unicode(
+        '/srv/jupyterhub/cwh_repo2docker_config.py',
+        help="The config file to load").tag(
+        config=True
+    )
+
+    schedule_file = Unicode(
+        help="Path of the YAML timetable of lectures").tag(
+        config=True
+    )
+
+    lead_time = Float(
+        600,
+        help="Default seconds before a lecture to start servers").tag(
+        config=True
+    )
+
+    cleanup_after = Float(
+        1800,
+        help="""
+        Default seconds after a lecture starts to stop pre-spawned servers
+        that were not used.
+        """).tag(
+        config=True
+    )
+
+    activity_grace = Float(
+        120,
+        help="""
+        Seconds after a server started within which its activity is not
+        counted as use.
+        """).tag(
+        config=True
+    )
+
+    concurrency = Integer(
+        10,
+        help="Maximum number of spawn requests at once").tag(
+        config=True
+    )
+
+    check_interval = Float(
+        60,
+        help="Interval in seconds between checks of the timetable").tag(
+        config=True
+    )
+
+    state_file = Unicode(
+        help="""
+        Path of the JSON file to keep the handled lectures and the started
+        servers in across restarts.  If empty, they are kept in memory only.
+        """).tag(
+        config=True
+    )
+
+    aliases = {
+        "config-file": "PreSpawnApplication.config_file",
+        "schedule-file": "PreSpawnApplication.schedule_file",
+        "state-file": "PreSpawnApplication.state_file",
+        "concurrency": "PreSpawnApplication.concurrency",
+    }
+
+    @catch_config_error
+    async def initialize(self, *args, **kwargs):
+        super().initialize(*args, **kwargs)
+
+        if os.path.exists(self.config_file):
+            self.load_config_file(self.config_file)
+
+        self.api_url = os.environ['JUPYTERHUB_API_URL'].rstrip('/')
+        self.api_token = os.environ['JUPYTERHUB_API_TOKEN']
+        self.http_client = AsyncHTTPClient()
+        self.registry = get_registry(config=self.config)
+
+        self.schedule = self.load_schedule()
+        self._handled = set()
+        self._progress = {}
+        self._prespawned = {}
+        self._prespawn_tasks = {}
+        self.load_state()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def load_schedule(self) -> Dict:
+        with open(self.schedule_file) as f:
+            schedule = load_schedule(f)
+        self.log.info('loaded %d lectures from %s',
+                      len(schedule.get('lectures', [])), self.schedule_file)
+        return schedule
+
+    def load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            self.log.warning('failed to load %s', self.state_file,
+                             exc_info=True)
+            return
+        for course, group, start in state.get('handled', []):
+            self._handled.add((course, group, datetime.fromisoformat(start)))
+        for course, group, start, names in state.get('progress', []):
+            key = (course, group, datetime.fromisoformat(start))
+            self._progress[key] = set(names)
+        for name, course, cleanup_at in state.get('prespawned', []):
+            self._prespawned[(name, course)] = \
+                datetime.fromisoformat(cleanup_at)
+        self.log.info('loaded %d handled lectures and %d pre-spawned servers'
+                      ' from %s', len(self._handled), len(self._prespawned),
+                      self.state_file)
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        state = {
+            'handled': [
+                [course, group, start.isoformat()]
+                for course, group, start in self._handled
+            ],
+            'progress': [
+                [course, group, start.isoformat(), sorted(names)]
+                for (course, group, start), names in self._progress.items()
+            ],
+            'prespawned': [
+                [name, course, cleanup_at.isoformat()]
+                for (name, course), cleanup_at in self._prespawned.items()
+            ],
+        }
+        tmp = self.state_file + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+        except OSError:
+            self.log.warning('failed to save %s', self.state_file,
+                             exc_info=True)
+
+    def get_lectures(self, now: datetime) -> List[Lecture]:
+        tz = self.schedule.get('timezone')
+        tz = ZoneInfo(tz) if tz else now.astimezone().tzinfo
+        lead_time = self.schedule.get('lead_time', self.lead_time)
+        cleanup_after = self.schedule.get('cleanup_after', self.cleanup_after)
+
+        lectures = []
+        for entry in self.schedule.get('lectures', []):
+            for start in lecture_starts(entry, now, tz):
+                lectures.append(Lecture(
+                    course=entry['course'],
+                    group=entry['group'],
+                    start=start,
+                    lead_time=entry.get('lead_time', lead_time),
+                    cleanup_after=entry.get('cleanup_after', cleanup_after),
+                    image=entry.get('image'),
+                ))
+        return lectures
+
+    async def api_request(self, method: str, path: str, body=None):
+        request = HTTPRequest(
+            self.api_url + path,
+            method=method,
+            headers={'Authorization': f'token {self.api_token}'},
+            body=None if body is None else json.dumps(body),
+            allow_nonstandard_methods=True,
+        )
+        response = await self.http_client.fetch(request)
+        if response.body:
+            return json.loads(response.body)
+        return None
+
+    async def check(self):
+        now = datetime.now().astimezone()
+        for lecture in self.get_lectures(now):
+            key = _lecture_key(lecture)
+            if key in self._handled or key in self._prespawn_tasks:
+                continue
+            prespawn_at = lecture.start - timedelta(seconds=lecture.lead_time)
+            if prespawn_at <= now < lecture.start:
+                task = asyncio.ensure_future(self.prespawn(lecture))
+                self._prespawn_tasks[key] = task
+                task.add_done_callback(
+                    lambda task, key=key: self._prespawn_tasks.pop(key, None))
+
+        for key in list(self._handled):
+            if key[2] < now - timedelta(days=2):
+                self._handled.discard(key)
+        for key in list(self._progress):
+            if key[2] < now - timedelta(days=2):
+                del self._progress[key]
+
+        await self.cleanup(now)
+        self.save_state()
+
+    async def prespawn(self, lecture: Lecture):
+        """
+        Start the servers of the students of a lecture who do not have one
+        started for it yet, and mark the lecture as handled.
+        """
+        try:
+            group = await self.api_request(
+                'GET', '/groups/{}'.format(quote(lecture.group, safe='')))
+        except HTTPClientError as e:
+            self.log.error('failed to get group %s: %s', lecture.group, e)
+            return
+        key = _lecture_key(lecture)
+        done = self._progress.get(key, set())
+        users = [name for name in group.get('users', []) if name not in done]
+
+        options = {}
+        if lecture.image:
+            options['image'] = self.registry.get_full_image_name(lecture.image)
+        else:
+            options['image'] = self.registry.get_default_course_image()
+
+        # spread the spawns over the lead time, leaving time for the last
+        # servers to boot before the lecture
+        window = (lecture.start - datetime.now().astimezone()).total_seconds()
+        interval = max(0, window * 0.8) / len(users) if users else 0
+        self.log.info('pre-spawning %s for %d users of %s every %.1fs',
+                      lecture.course, len(users), lecture.group, interval)
+
+        async def spawn(index, name):
+            await asyncio.sleep(index * interval)
+            async with self._semaphore:
+                try:
+                    await self.spawn(name, lecture, options)
+                except Exception:
+                    # keep pre-spawning the servers of the other users
+                    self.log.exception('failed to pre-spawn %s:%s',
+                                       name, lecture.course)
+
+        await asyncio.gather(
+            *[spawn(i, name) for i, name in enumerate(users)])
+        self._handled.add(key)
+        self._progress.pop(key, None)
+        self.save_state()
+
+    async def spawn(self, name: str, lecture: Lecture, options: Dict):
+        user_path = '/users/{}'.format(quote(name, safe=''))
+        server_path = '{}/servers/{}'.format(
+            user_path, quote(lecture.course, safe=''))
+        try:
+            user = await self.api_request('GET', user_path)
+            if lecture.course in (user.get('servers') or {}):
+                self.log.debug('%s:%s is already running',
+                               name, lecture.course)
+                self._spawned(name, lecture)
+                return
+
+            for _ in range(10):
+                try:
+                    await self.api_request('POST', server_path, options)
+                    break
+                except HTTPClientError as e:
+                    if e.code != 429:
+                        raise
+                    # the hub's concurrent spawn limit
+                    retry_after = 10
+                    if e.response is not None:
+                        retry_after = int(
+                            e.response.headers.get('Retry-After', retry_after))
+                    await asyncio.sleep(retry_after)
+            else:
+                self.log.warning('gave up pre-spawning %s:%s',
+                                 name, lecture.course)
+                return
+        except HTTPClientError as e:
+            self.log.error('failed to pre-spawn %s:%s: %s',
+                           name, lecture.course, e)
+            return
+
+        cleanup_at = lecture.start + timedelta(seconds=lecture.cleanup_after)
+        self._prespawned[(name, lecture.course)] = cleanup_at
+        self.log.info('pre-spawned %s:%s', name, lecture.course)
+        self._spawned(name, lecture)
+
+    def _spawned(self, name: str, lecture: Lecture):
+        self._progress.setdefault(_lecture_key(lecture), set()).add(name)
+        self.save_state()
+
+    async def cleanup(self, now: datetime):
+        """
+        Stop the pre-spawned servers that nobody used.
+        """
+        for key, cleanup_at in list(self._prespawned.items()):
+            if now < cleanup_at:
+                continue
+            del self._prespawned[key]
+            name, course = key
+            user_path = '/users/{}'.format(quote(name, safe=''))
+            try:
+                user = await self.api_request('GET', user_path)
+                server = (user.get('servers') or {}).get(course)
+                if server is None or self._used(server):
+                    continue
+                self.log.info('stopping unused pre-spawned server %s:%s',
+                              name, course)
+                await self.api_request(
+                    'DELETE', '{}/servers/{}'.format(
+                        user_path, quote(course, safe='')))
+            except HTTPClientError as e:
+                self.log.error('failed to clean up %s:%s: %s', name, course, e)
+
+    def _used(self, server: Dict) -> bool:
+        started = _parse_timestamp(server.get('started'))
+        last_activity = _parse_timestamp(server.get('last_activity'))
+        if started is None or last_activity is None:
+            return True
+        return last_activity > started + timedelta(seconds=self.activity_grace)
+
+    async def start(self):
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                self.log.exception('failed to check the timetable')
+            await asyncio.sleep(self.check_interval)
+
+    async def launch_instance_async(self, argv=None):
+        try:
+            await self.initialize(argv)
+        except Exception:
+            self.log.exception("")
+            self.exit(1)
+        asyncio.ensure_future(self.start())
+
+
+def main():
+    app = PreSpawnApplication()
+
+    loop = IOLoop(make_current=False)
+    loop.run_sync(app.launch_instance_async)
+    loop.asyncio_loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+    try:
+        loop.start()
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    finally:
+        loop.stop()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 import aiohttp
 import asyncio
 import json
+import os
+import random
+import time
 from typing import (
+    Any,
+    Awaitable,
+    Callable,
     Dict,
     Optional,
     Tuple,
@@ -13,13 +19,21 @@ from yarl import URL
 from textwrap import dedent
 from traitlets import (
     Unicode,
-    Bool
+    Bool,
+    Float,
+    Integer
 )
 from traitlets.config import SingletonConfigurable
 
+from .cache import DigestCache, verify_digest
+from .catalog import SpawnableImages
+from .index import CatalogStamp, LayerIndex, RepositoryIndex
+
 
 CONTENT_TYPE_MANIFEST_V2_2 = 'application/vnd.docker.distribution.manifest.v2+json'
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 def get_registry(*args, **kwargs):
     return Registry.instance(*args, **kwargs)
@@ -35,10 +49,13 @@ async def _get_manifest(
     }
     async with session.get(
             f'{url}{name}/manifests/{ref}',
-            headers=headers) as resp:
-        manifest = await resp.json()
+            headers=headers,
+            raise_for_status=False) as resp:
         if resp.status == 404:
+            await resp.read()
             return None
+        resp.raise_for_status()
+        manifest = await resp.json()
         return {
             'name': name,
             'reference': ref,
@@ -47,6 +64,27 @@ async def _get_manifest(
         }
 
 
+async def _head_manifest(
+        session: aiohttp.ClientSession,
+        url: str,
+        name: str,
+        ref: str) -> Optional[str]:
+    headers = {
+        'Accept': CONTENT_TYPE_MANIFEST_V2_2
+    }
+    async with session.head(
+            f'{url}{name}/manifests/{ref}',
+            headers=headers,
+            raise_for_status=False) as resp:
+        await resp.read()
+        if resp.status != 200:
+            return None
+        digest = resp.headers.get('Docker-Content-Digest')
+        if digest is None and 'ETag' in resp.headers:
+            digest = resp.headers['ETag'].strip('"')
+        return digest
+
+
 async def _put_manifest(
         session: aiohttp.ClientSession,
         url: str,
@@ -78,19 +116,43 @@ async def _delete_manifest(
         await resp.read()
 
 
+async def _get_paginated(
+        session: aiohttp.ClientSession,
+        url: str,
+        key: str) -> Dict:
+    """
+    Get a paginated list, following `Link: <...>; rel="next"` headers,
+    and return the first page with `key` holding the items of all pages.
+    """
+    result = None
+    next_url = url
+    while next_url is not None:
+        async with session.get(next_url) as resp:
+            page = await resp.json()
+            next_link = resp.links.get('next')
+            next_url = next_link['url'] if next_link else None
+        if result is None:
+            result = page
+        elif page.get(key):
+            result[key] = (result.get(key) or []) + page[key]
+    return result
+
+
 async def _get_tags(
         session: aiohttp.ClientSession,
         url: str,
-        repo: str) -> None:
-    async with session.get(f'{url}{repo}/tags/list') as resp:
-        return await resp.json()
+        repo: str) -> Dict:
+    return await _get_paginated(session, f'{url}{repo}/tags/list', 'tags')
 
 
 async def _get_repos(
         session: aiohttp.ClientSession,
-        url: str) -> Dict:
-    async with session.get(f'{url}_catalog') as resp:
-        return await resp.json()
+        url: str,
+        page_size: int = 0) -> Dict:
+    catalog_url = f'{url}_catalog'
+    if page_size > 0:
+        catalog_url += f'?n={page_size}'
+    return await _get_paginated(session, catalog_url, 'repositories')
 
 
 async def _get_config(
@@ -98,11 +160,16 @@ async def _get_config(
         url: str,
         repo: str,
         ref: str,
-        manifest: Dict) -> Dict:
+        manifest: Dict,
+        cache: Optional[DigestCache] = None) -> Dict:
     config_digest = manifest['data']['config']['digest']
-    config_blob = await _get_blob(
-        session, url, repo, config_digest)
-    config = json.loads(config_blob)
+    config = cache.get(config_digest) if cache is not None else None
+    if config is None:
+        config_blob = await _get_blob(
+            session, url, repo, config_digest)
+        config = json.loads(config_blob)
+        if cache is not None and verify_digest(config_blob, config_digest):
+            cache.put(config_digest, config)
     return {
         'name': repo,
         'reference': ref,
@@ -153,6 +220,10 @@ async def _head_blob(
 def split_image_name(
         image_name: str,
         default_tag: str = 'latest') -> Tuple[str, str]:
+    if '@' in image_name:
+        # digest reference, e.g. name@sha256:...
+        name, digest = image_name.split('@', 1)
+        return (name, digest)
     parts = image_name.rsplit(':', 1)
     if len(parts) == 2:
         name, tag = parts
@@ -166,6 +237,43 @@ def _short_id(id: str) -> str:
     return id[sep+1:sep+13]
 
 
+def _manifest_blobs(manifest: Dict) -> List[str]:
+    blobs = [layer['digest'] for layer in manifest.get('layers', [])]
+    if 'config' in manifest:
+        blobs.append(manifest['config']['digest'])
+    return blobs
+
+
+def _retry_after(headers) -> Optional[float]:
+    if headers is None or 'Retry-After' not in headers:
+        return None
+    try:
+        return max(float(headers['Retry-After']), 0.0)
+    except ValueError:
+        return None
+
+
+async def _gather_limited(
+        limit: int,
+        aws: List[Awaitable],
+        return_exceptions: bool = False) -> List:
+    """
+    Same as `asyncio.gather`, but await at most `limit` awaitables at once.
+    """
+    if limit <= 0:
+        return await asyncio.gather(
+            *aws, return_exceptions=return_exceptions)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(
+        *[run(aw) for aw in aws], return_exceptions=return_exceptions)
+
+
 class Registry(SingletonConfigurable):
     """
     Docker registry client to manage course images.
@@ -229,9 +337,229 @@ class Registry(SingletonConfigurable):
         """
     )
 
+    catalog_cache_ttl = Float(
+        30,
+        config=True,
+        help=dedent(
+            """
+            Seconds to reuse the image catalog returned by `list_images`
+            without contacting the registry.
+            Set 0 to disable the catalog cache.
+            """
+        )
+    )
+
+    catalog_cache_stale_ttl = Float(
+        300,
+        config=True,
+        help=dedent(
+            """
+            Seconds after `catalog_cache_ttl` has expired during which
+            `list_images` still returns the cached catalog immediately
+            while refreshing it in the background.
+            Set 0 to always wait for the refresh.
+            """
+        )
+    )
+
+    config_cache_size = Integer(
+        4096,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of image config blobs kept in memory.
+            Config blobs are immutable and cached by their digest.
+            """
+        )
+    )
+
+    cache_dir = Unicode(
+        '',
+        config=True,
+        help=dedent(
+            """
+            Directory to keep registry metadata caches in across restarts.
+            If empty, the caches are kept in memory only.
+            """
+        )
+    )
+
+    pool_size = Integer(
+        100,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of simultaneous connections to the registry
+            in the shared connection pool.
+            0 means no limit.
+            """
+        )
+    )
+
+    pool_size_per_host = Integer(
+        0,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of simultaneous connections to the same
+            host and port in the shared connection pool.
+            0 means no limit.
+            """
+        )
+    )
+
+    keepalive_timeout = Float(
+        60,
+        config=True,
+        help=dedent(
+            """
+            Seconds to keep idle connections to the registry open
+            for reuse.
+            """
+        )
+    )
+
+    dns_cache_ttl = Integer(
+        10,
+        config=True,
+        help=dedent(
+            """
+            Seconds to cache resolved addresses of the registry host.
+            """
+        )
+    )
+
+    tag_fetch_concurrency = Integer(
+        8,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of tag lists fetched at once
+            while listing images.
+            0 means no limit.
+            """
+        )
+    )
+
+    manifest_fetch_concurrency = Integer(
+        16,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of manifests fetched at once
+            while listing images.
+            0 means no limit.
+            """
+        )
+    )
+
+    config_fetch_concurrency = Integer(
+        16,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of image config blobs fetched at once
+            while listing images.
+            0 means no limit.
+            """
+        )
+    )
+
+    delete_concurrency = Integer(
+        8,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of manifests or blobs deleted at once.
+            0 means no limit.
+            """
+        )
+    )
+
+    catalog_page_size = Integer(
+        100,
+        config=True,
+        help=dedent(
+            """
+            Number of repositories requested per page of `_catalog`.
+            0 uses the default page size of the registry.
+            """
+        )
+    )
+
+    max_retries = Integer(
+        3,
+        config=True,
+        help=dedent(
+            """
+            Maximum number of retries of a read request that failed with
+            429, a 5xx status, a connection error or a timeout.
+            """
+        )
+    )
+
+    retry_backoff = Float(
+        0.5,
+        config=True,
+        help=dedent(
+            """
+            Base delay in seconds of the jittered exponential backoff
+            between retries.
+            A `Retry-After` header sent by the registry takes precedence.
+            """
+        )
+    )
+
+    repository_reconcile_interval = Float(
+        3600,
+        config=True,
+        help=dedent(
+            """
+            Seconds between full scans of the registry catalog.
+
+            In between, `list_images` only walks the repositories known to
+            hold course images, which are recorded when images are listed,
+            built or tagged.
+            Set 0 to scan the whole catalog on every listing.
+            """
+        )
+    )
+
     def __init__(self, *args, **kwargs):
         super(Registry, self).__init__(*args, **kwargs)
 
+        self._session = None
+        self._session_closer = None
+
+        self._config_cache = DigestCache(
+            self.config_cache_size,
+            self._get_cache_dir('configs'),
+            log=self.log)
+
+        self._manifests = {}
+
+        index_dir = self._get_cache_dir('index')
+        self._repositories = RepositoryIndex(
+            os.path.join(index_dir, 'repositories.json')
+            if index_dir else None,
+            log=self.log)
+        self._layers = LayerIndex(
+            os.path.join(index_dir, 'layers.json')
+            if index_dir else None,
+            log=self.log)
+        self._catalog_stamp = CatalogStamp(
+            os.path.join(index_dir, 'catalog.json')
+            if index_dir else None,
+            log=self.log)
+
+        self._catalog = None
+        self._catalog_time = 0.0
+        self._catalog_epoch = 0
+        self._catalog_generation = 0
+        self._spawnable_images = None
+        self._catalog_fingerprint = None
+        self._catalog_refresh = None
+
         self.log.debug('Registry host: %s', self.host)
         self.log.debug('Registry user: %s', self.username)
         self.log.debug('default_course_image: %s',
@@ -243,9 +571,53 @@ class Registry(SingletonConfigurable):
         scheme = 'https' if not self.insecure else 'http'
         return f'{scheme}://{self.host}/v2/'
 
+    def _get_cache_dir(self, name: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, name)
+
     def _get_auth(self):
         return aiohttp.BasicAuth(self.username, self.password)
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the connection-pooled session shared by all registry requests.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl)
+            self._session = aiohttp.ClientSession(
+                auth=self._get_auth(),
+                raise_for_status=True,
+                connector=connector)
+            self._session_closer = asyncio.ensure_future(
+                self._close_session_on_cancel(self._session))
+        return self._session
+
+    async def _close_session_on_cancel(
+            self,
+            session: aiohttp.ClientSession) -> None:
+        # JupyterHub cancels all pending tasks on shutdown,
+        # which closes the session while the event loop is still running.
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await session.close()
+
+    async def close(self) -> None:
+        """
+        Close the shared session and its pooled connections.
+        """
+        session, self._session = self._session, None
+        closer, self._session_closer = self._session_closer, None
+        if closer is not None:
+            closer.cancel()
+        if session is not None:
+            await session.close()
+
     def get_default_course_image(self) -> str:
         host = self.host
         name = self.default_course_image
@@ -260,144 +632,341 @@ class Registry(SingletonConfigurable):
         host = self.host
         return f'{host}/{name}'
 
+    @property
+    def catalog_generation(self) -> int:
+        """
+        Counter incremented whenever the set of images or their digests
+        returned by `list_images` changes.
+        """
+        return self._catalog_generation
+
+    def invalidate_catalog(self) -> None:
+        """
+        Discard the cached image catalog.
+
+        The next `list_images` call waits for a fresh listing, and a refresh
+        already in flight is not allowed to store its result.
+        With `cache_dir` set, the catalogs cached by other processes sharing
+        it are discarded too.
+        """
+        self._catalog_stamp.touch()
+        self._discard_catalog()
+
+    def _discard_catalog(self) -> None:
+        self._catalog = None
+        self._catalog_epoch += 1
+        self._catalog_refresh = None
+
     async def list_images(self) -> List[Dict]:
-        async with aiohttp.ClientSession(
-                auth=self._get_auth(),
-                raise_for_status=True) as session:
-            url = self.get_registry_url()
-            self.log.debug('registry host=%s, registry url=%s', self.host, url)
+        images = await self._get_catalog()
+        return [dict(i) for i in images]
+
+    async def get_spawnable_images(self) -> SpawnableImages:
+        """
+        Return the compact view of the images listed by `list_images`.
 
+        The same view is returned until the catalog generation changes.
+        """
+        images = await self._get_catalog()
+        spawnable = self._spawnable_images
+        if (spawnable is None or
+                spawnable.generation != self._catalog_generation):
+            spawnable = SpawnableImages(
+                images, self._catalog_generation, self.host)
+            self._spawnable_images = spawnable
+        return spawnable
+
+    async def _get_catalog(self) -> List[Dict]:
+        if self._catalog_stamp.changed():
+            self._discard_catalog()
+        if self._catalog is not None and self.catalog_cache_ttl > 0:
+            age = time.monotonic() - self._catalog_time
+            if age < self.catalog_cache_ttl:
+                return self._catalog
+            if age < self.catalog_cache_ttl + self.catalog_cache_stale_ttl:
+                self._start_catalog_refresh()
+                return self._catalog
+
+        return await asyncio.shield(self._start_catalog_refresh())
+
+    def _start_catalog_refresh(self) -> asyncio.Future:
+        if self._catalog_refresh is None:
+            refresh = asyncio.ensure_future(
+                self._refresh_catalog(self._catalog_epoch))
+            refresh.add_done_callback(self._catalog_refresh_done)
+            self._catalog_refresh = refresh
+        return self._catalog_refresh
+
+    def _catalog_refresh_done(self, refresh: asyncio.Future) -> None:
+        if self._catalog_refresh is refresh:
+            self._catalog_refresh = None
+        if not refresh.cancelled() and refresh.exception() is not None:
+            self.log.warning('failed to refresh image catalog: %s',
+                             refresh.exception())
+
+    async def _refresh_catalog(self, epoch: int) -> List[Dict]:
+        images = await self._fetch_images()
+        if epoch == self._catalog_epoch:
+            fingerprint = sorted(
+                (i['image_name'], i['manifest_digest'],
+                 i['default_course_image'])
+                for i in images)
+            if fingerprint != self._catalog_fingerprint:
+                self._catalog_fingerprint = fingerprint
+                self._catalog_generation += 1
+            self._catalog = images
+            self._catalog_time = time.monotonic()
+        return images
+
+    async def _fetch_images(self) -> List[Dict]:
+        session = self._get_session()
+        url = self.get_registry_url()
+        self.log.debug('registry host=%s, registry url=%s', self.host, url)
+
+        self._repositories.reload()
+        started_at = time.time()
+        full_scan = (
+            self.repository_reconcile_interval <= 0 or
+            started_at - self._repositories.reconciled_at >=
+            self.repository_reconcile_interval)
+        if full_scan:
+            self.log.debug('scanning all repositories')
             repos = await self._list_image_names(session)
-            manifests = await self._list_manifests(session, repos)
-
-            tasks = []
-            for manifest in manifests:
-                name = manifest['name']
-                ref = manifest['reference']
-                tasks.append(asyncio.ensure_future(
-                    _get_config(session, url, name, ref, manifest)))
-            configs = await asyncio.gather(*tasks)
-
-            self.log.debug('found images: %s',
-                           [f"{c['name']}:{c['reference']}" for c in configs])
-
-            default_course_image = None
-            initial_course_image = None
-            images = []
-            for config in configs:
-                labels = config['data'].get('config', {}).get('Labels', {})
-                name = config['name']
-                ref = config['reference']
-                image_name_ref = f'{name}:{ref}'
-                if self.default_course_image == image_name_ref:
-                    self.log.debug(
-                        'found default course image: %s labels=%s, digest=%s',
-                        image_name_ref, labels, config['digest'])
-                    default_course_image = config['digest']
-                elif self.initial_course_image == image_name_ref:
-                    self.log.debug(
-                        'found initial course image: %s labels=%s digest=%s',
-                        image_name_ref, labels, config['digest'])
-                    initial_course_image = {
-                        "repo": None,
-                        "ref": None,
-                        "image_name": image_name_ref,
-                        "display_name": 'initial',
-                        "image_id": config['digest'],
-                        "short_image_id": _short_id(config['digest']),
-                        "manifest_digest": config['manifest']['digest'],
-                        "status": "-",
-                        "config": config["data"],
-                        "default_course_image": False,
-                        "initial_course_image": True,
-                    }
-                elif ('cwh_repo2docker.image_name' in labels and
-                        image_name_ref == labels['cwh_repo2docker.image_name']):
-                    self.log.debug(
-                        'found repo2docker course image: %s labels=%s digest=%s',
-                        image_name_ref, labels, config['digest'])
-                    images.append({
-                        "repo": labels["repo2docker.repo"],
-                        "ref": labels["repo2docker.ref"],
-                        "image_name": labels["cwh_repo2docker.image_name"],
-                        "display_name": labels["cwh_repo2docker.display_name"],
-                        "image_id": config['digest'],
-                        "short_image_id": _short_id(config['digest']),
-                        "manifest_digest": config['manifest']['digest'],
-                        "status": "built",
-                        "config": config["data"],
-                        "default_course_image": False,
-                        "initial_course_image": False,
-                    })
-                else:
-                    self.log.debug('not course image: %s labels=%s digest=%s',
-                                   image_name_ref, labels, config['digest'])
-
-            if initial_course_image:
-                images.append(initial_course_image)
-
-            if default_course_image:
-                for image in images:
-                    if image['image_id'] == default_course_image:
-                        image['default_course_image'] = True
-
-            return images
+        else:
+            repos = await self._list_image_names(
+                session, self._get_course_repositories())
+        manifests = await self._list_manifests(session, repos)
+        self._forget_manifests(repos)
+
+        tasks = []
+        for manifest in manifests:
+            name = manifest['name']
+            ref = manifest['reference']
+            tasks.append(self._with_retry(
+                _get_config, session, url, name, ref, manifest,
+                self._config_cache))
+        configs = await _gather_limited(self.config_fetch_concurrency, tasks)
+
+        self.log.debug('found images: %s',
+                       [f"{c['name']}:{c['reference']}" for c in configs])
+
+        default_course_image = None
+        initial_course_image = None
+        images = []
+        for config in configs:
+            labels = config['data'].get('config', {}).get('Labels', {})
+            name = config['name']
+            ref = config['reference']
+            image_name_ref = f'{name}:{ref}'
+            if self.default_course_image == image_name_ref:
+                self.log.debug(
+                    'found default course image: %s labels=%s, digest=%s',
+                    image_name_ref, labels, config['digest'])
+                default_course_image = config['digest']
+            elif self.initial_course_image == image_name_ref:
+                self.log.debug(
+                    'found initial course image: %s labels=%s digest=%s',
+                    image_name_ref, labels, config['digest'])
+                initial_course_image = {
+                    "repo": None,
+                    "ref": None,
+                    "image_name": image_name_ref,
+                    "display_name": 'initial',
+                    "image_id": config['digest'],
+                    "short_image_id": _short_id(config['digest']),
+                    "manifest_digest": config['manifest']['digest'],
+                    "status": "-",
+                    "config": config["data"],
+                    "default_course_image": False,
+                    "initial_course_image": True,
+                }
+            elif ('cwh_repo2docker.image_name' in labels and
+                    image_name_ref == labels['cwh_repo2docker.image_name']):
+                self.log.debug(
+                    'found repo2docker course image: %s labels=%s digest=%s',
+                    image_name_ref, labels, config['digest'])
+                images.append({
+                    "repo": labels["repo2docker.repo"],
+                    "ref": labels["repo2docker.ref"],
+                    "image_name": labels["cwh_repo2docker.image_name"],
+                    "display_name": labels["cwh_repo2docker.display_name"],
+                    "image_id": config['digest'],
+                    "short_image_id": _short_id(config['digest']),
+                    "manifest_digest": config['manifest']['digest'],
+                    "status": "built",
+                    "config": config["data"],
+                    "default_course_image": False,
+                    "initial_course_image": False,
+                })
+            else:
+                self.log.debug('not course image: %s labels=%s digest=%s',
+                               image_name_ref, labels, config['digest'])
+
+        if initial_course_image:
+            images.append(initial_course_image)
+
+        if default_course_image:
+            for image in images:
+                if image['image_id'] == default_course_image:
+                    image['default_course_image'] = True
+
+        if full_scan and self.repository_reconcile_interval > 0:
+            self._repositories.reconcile(
+                [split_image_name(i['image_name'])[0] for i in images],
+                started_at)
+
+        return images
+
+    def add_course_repository(self, name: str) -> None:
+        """
+        Record that the repository `name` holds course images.
+        """
+        self._repositories.add([name])
+
+    def _get_course_repositories(self) -> List[str]:
+        names = self._repositories.names()
+        names.add(split_image_name(self.default_course_image)[0])
+        names.add(split_image_name(self.initial_course_image)[0])
+        return sorted(names)
 
     async def inspect_image(self, name: str, ref: str) -> Optional[Dict]:
-        async with aiohttp.ClientSession(
-                auth=self._get_auth(),
-                raise_for_status=True) as session:
-            url = self.get_registry_url()
+        session = self._get_session()
+        url = self.get_registry_url()
 
-            manifest = await _get_manifest(session, url, name, ref)
-            if manifest is None:
-                return None
+        manifest = await self._fetch_manifest(session, name, ref)
+        if manifest is None:
+            return None
 
-            return await _get_config(session, url, name, ref, manifest)
+        return await _get_config(session, url, name, ref, manifest,
+                                 self._config_cache)
 
     async def delete_image(self, name: str, ref: str) -> None:
-        async with aiohttp.ClientSession(
-                auth=self._get_auth(),
-                raise_for_status=True) as session:
-            url = self.get_registry_url()
+        errors = await self.delete_images([(name, ref)])
+        # an image that is not found is already deleted
+        if errors[0] is not None and not isinstance(errors[0], LookupError):
+            raise errors[0]
 
-            manifest = await _get_manifest(session, url, name, ref)
-            if manifest is None:
-                # image not found
-                return
-            config = await _get_config(session, url, name, ref, manifest)
-            manifest_digest = manifest['digest']
-
-            repos = await self._list_image_names(session)
-            repos = [r for r in repos if r[0] != name and r[1] != ref]
-            marked_layers = await self._mark_blobs(session, repos)
+    async def delete_images(
+            self,
+            images: List[Tuple[str, str]]) -> List[Optional[Exception]]:
+        """
+        Delete images and the blobs no longer referenced in their
+        repositories.
 
-            await _delete_manifest(session, url, name, manifest_digest)
+        Returns the error for each image, or None if it was deleted.
+        The error of an image that is not found is a `LookupError`.
+        """
+        try:
+            return await self._delete_images(images)
+        finally:
+            self.invalidate_catalog()
 
-            tasks = []
-            tasks.append(asyncio.ensure_future(
-                _delete_blob(session, url, name, config['digest'])))
+    async def _delete_images(
+            self,
+            images: List[Tuple[str, str]]) -> List[Optional[Exception]]:
+        session = self._get_session()
+        url = self.get_registry_url()
 
-            layers = manifest['data']['layers']
-            for layer in layers:
-                if (layer['digest'] not in marked_layers):
-                    tasks.append(asyncio.ensure_future(
-                        _delete_blob(session, url, name, layer['digest'])))
+        manifests = await asyncio.gather(
+            *[self._fetch_manifest(session, name, ref) for name, ref in images],
+            return_exceptions=True)
+        errors = [m if isinstance(m, Exception) else None for m in manifests]
+        for i, ((name, ref), manifest) in enumerate(zip(images, manifests)):
+            if errors[i] is None and manifest is None:
+                errors[i] = LookupError(f"image not found: '{name}:{ref}'")
+
+        # images sharing a manifest are deleted together
+        targets = {}
+        for i, ((name, ref), manifest) in enumerate(zip(images, manifests)):
+            if errors[i] is None and manifest is not None:
+                targets.setdefault((name, manifest['digest']), []).append(i)
+
+        # other tags of the repositories may share layers with the images
+        repos = sorted({name for name, _ in targets})
+        indexed = await asyncio.gather(
+            *[self._index_repository(session, name) for name in repos],
+            return_exceptions=True)
+        for name, result in zip(repos, indexed):
+            if isinstance(result, Exception):
+                for key in [k for k in targets if k[0] == name]:
+                    for i in targets.pop(key):
+                        errors[i] = result
+
+        keys = list(targets)
+        deleted = await _gather_limited(
+            self.delete_concurrency,
+            [_delete_manifest(session, url, name, digest)
+             for name, digest in keys],
+            return_exceptions=True)
+
+        unreferenced = []
+        for (name, digest), result in zip(keys, deleted):
+            if isinstance(result, Exception):
+                for i in targets[(name, digest)]:
+                    errors[i] = result
+                continue
+            for key, m in list(self._manifests.items()):
+                if key[0] == name and m['digest'] == digest:
+                    del self._manifests[key]
+            unreferenced.extend(
+                (name, blob) for blob in self._layers.remove(name, digest))
+        self._layers.save()
+        self.log.debug('delete unreferenced blobs: %s', unreferenced)
+
+        results = await _gather_limited(
+            self.delete_concurrency,
+            [_delete_blob(session, url, name, blob)
+             for name, blob in unreferenced],
+            return_exceptions=True)
+        for (name, blob), result in zip(unreferenced, results):
+            if isinstance(result, Exception):
+                self.log.warning('failed to delete blob %s of %s: %s',
+                                 blob, name, result)
+
+        return errors
+
+    async def _index_repository(
+            self,
+            session: aiohttp.ClientSession,
+            name: str) -> None:
+        """
+        Bring the layer index of the repository up to date with its tags.
 
-            await asyncio.gather(*tasks)
+        Only tags whose manifest digest is not indexed yet are downloaded.
+        """
+        url = self.get_registry_url()
+        taginfo = await self._get_repo_tags(session, url, name)
+        tags = taginfo.get('tags') or []
+
+        async def get_digest(tag):
+            digest = await self._with_retry(
+                _head_manifest, session, url, name, tag)
+            if digest is None or self._layers.get(name, digest) is None:
+                manifest = await self._with_retry(
+                    self._fetch_manifest, session, name, tag)
+                digest = manifest['digest'] if manifest else None
+            return digest
+
+        digests = await _gather_limited(
+            self.manifest_fetch_concurrency,
+            [get_digest(tag) for tag in tags])
+        self._layers.sync(name, [d for d in digests if d is not None])
 
     async def _list_image_names(
             self,
-            session: aiohttp.ClientSession) -> List[Tuple[str, str]]:
+            session: aiohttp.ClientSession,
+            repo_names: Optional[List[str]] = None) -> List[Tuple[str, str]]:
         url = self.get_registry_url()
-        repos_dict = await _get_repos(session, url)
-        repo_names = repos_dict['repositories']
+        if repo_names is None:
+            repos_dict = await self._with_retry(
+                _get_repos, session, url, self.catalog_page_size)
+            repo_names = repos_dict.get('repositories') or []
 
         tasks = []
         for name in repo_names:
-            tasks.append(asyncio.ensure_future(_get_tags(session, url, name)))
+            tasks.append(self._get_repo_tags(session, url, name))
 
-        taginfos = await asyncio.gather(*tasks)
+        taginfos = await _gather_limited(self.tag_fetch_concurrency, tasks)
         repos = []
         for taginfo in taginfos:
             name = taginfo['name']
@@ -408,29 +977,98 @@ class Registry(SingletonConfigurable):
                 repos.append((name, tag))
         return repos
 
+    async def _get_repo_tags(
+            self,
+            session: aiohttp.ClientSession,
+            url: str,
+            name: str) -> Dict:
+        try:
+            return await self._with_retry(_get_tags, session, url, name)
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                raise
+            # the repository is recorded but nothing has been pushed yet
+            return {'name': name, 'tags': None}
+
     async def _list_manifests(
             self,
             session: aiohttp.ClientSession,
             repos: List[Tuple[str, str]]):
         tasks = []
-        url = self.get_registry_url()
         for name, tag in repos:
-            tasks.append(asyncio.ensure_future(
-                    _get_manifest(session, url, name, tag)))
-        manifests = await asyncio.gather(*tasks)
+            tasks.append(self._with_retry(
+                self._fetch_manifest, session, name, tag))
+        manifests = await _gather_limited(
+            self.manifest_fetch_concurrency, tasks)
         return manifests
 
-    async def _mark_blobs(
+    async def _with_retry(
+            self,
+            func: Callable[..., Awaitable],
+            *args) -> Any:
+        """
+        Call `func(*args)`, retrying with jittered exponential backoff
+        while the registry is overloaded or unreachable.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(e.headers)
+                error = e
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = None
+                error = e
+            if delay is None:
+                delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+            attempt += 1
+            self.log.debug('retrying registry request in %.2fs (%d/%d): %s',
+                           delay, attempt, self.max_retries, error)
+            await asyncio.sleep(delay)
+
+    async def _fetch_manifest(
             self,
             session: aiohttp.ClientSession,
-            images: List[Tuple[str, str]]):
-        manifests = await self._list_manifests(session, images)
-        digests = set()
-        for manifest in manifests:
-            digests.update(
-                [layer['digest'] for layer in manifest['data']['layers']]
-            )
-        return digests
+            name: str,
+            ref: str) -> Optional[Dict]:
+        """
+        Get the manifest of `name:ref`.
+
+        If the manifest of the tag has been fetched before, its digest is
+        revalidated with a HEAD request and the full manifest is downloaded
+        only when the tag points to another manifest.
+        """
+        url = self.get_registry_url()
+        cached = self._manifests.get((name, ref))
+        if cached is not None:
+            digest = await _head_manifest(session, url, name, ref)
+            if digest is not None and digest == cached['digest']:
+                return cached
+
+        manifest = await _get_manifest(session, url, name, ref)
+        if manifest is not None and manifest['digest'] is not None:
+            self._manifests[(name, ref)] = manifest
+            self._layers.add(
+                name, manifest['digest'], _manifest_blobs(manifest['data']))
+        else:
+            self._manifests.pop((name, ref), None)
+        return manifest
+
+    def _forget_manifests(self, images: List[Tuple[str, str]]) -> None:
+        """
+        Drop remembered manifests of tags that no longer exist
+        in the listed repositories.
+        """
+        listed = set(images)
+        names = {name for name, _ in images}
+        for key in list(self._manifests):
+            if key[0] in names and key not in listed:
+                del self._manifests[key]
 
     async def set_default_course_image(self, name: str, ref: str):
         new_name, new_ref = split_image_name(self.default_course_image)
@@ -443,36 +1081,52 @@ class Registry(SingletonConfigurable):
             new_tag: str,
             src_name: str,
             src_tag: str):
-        async with aiohttp.ClientSession(
-                auth=self._get_auth(),
-                raise_for_status=True) as session:
-            url = self.get_registry_url()
-
-            manifest = await _get_manifest(session, url, src_name, src_tag)
-            if manifest is None:
-                raise RuntimeError(f"image not found: '{src_name}:{src_tag}'")
-
-            tasks = []
-            config_digest = manifest['data']['config']['digest']
-            tasks.append(asyncio.ensure_future(self._mount_blob(
-                session, url, new_name, config_digest, src_name)))
-            layers = manifest['data']['layers']
-            for layer in layers:
-                digest = layer['digest']
-                tasks.append(asyncio.ensure_future(
-                    self._mount_blob(session, url, new_name, digest, src_name)))
-            mounted_blobs = await asyncio.gather(*tasks)
-            self.log.debug('mounted blobs: dest=%s from=%s, %s',
-                           new_name, src_name, str(mounted_blobs))
-
-            if (any([x is None for x in mounted_blobs])):
-                raise RuntimeError('failed to mount blobs')
-
-            return await _put_manifest(
-                session,
-                url,
-                new_name, new_tag,
-                manifest['data'])
+        try:
+            return await self._set_name_tag(
+                new_name, new_tag, src_name, src_tag)
+        finally:
+            self.invalidate_catalog()
+
+    async def _set_name_tag(
+            self,
+            new_name: str,
+            new_tag: str,
+            src_name: str,
+            src_tag: str):
+        self.add_course_repository(new_name)
+        session = self._get_session()
+        url = self.get_registry_url()
+
+        manifest = await self._fetch_manifest(session, src_name, src_tag)
+        if manifest is None:
+            raise RuntimeError(f"image not found: '{src_name}:{src_tag}'")
+
+        tasks = []
+        config_digest = manifest['data']['config']['digest']
+        tasks.append(asyncio.ensure_future(self._mount_blob(
+            session, url, new_name, config_digest, src_name)))
+        layers = manifest['data']['layers']
+        for layer in layers:
+            digest = layer['digest']
+            tasks.append(asyncio.ensure_future(
+                self._mount_blob(session, url, new_name, digest, src_name)))
+        mounted_blobs = await asyncio.gather(*tasks)
+        self.log.debug('mounted blobs: dest=%s from=%s, %s',
+                       new_name, src_name, str(mounted_blobs))
+
+        if (any([x is None for x in mounted_blobs])):
+            raise RuntimeError('failed to mount blobs')
+
+        result = await _put_manifest(
+            session,
+            url,
+            new_name, new_tag,
+            manifest['data'])
+        if result['digest'] is not None:
+            self._layers.add(
+                new_name, result['digest'], _manifest_blobs(manifest['data']))
+            self._layers.save()
+        return result
 
     async def _mount_blob(
             self,
@@ -1,4 +1,5 @@
 import os
+import signal
 from urllib.parse import urlparse
 
 from tornado import web
@@ -15,9 +16,10 @@ from jupyterhub._data import DATA_FILES_PATH
 
 from jinja2 import ChoiceLoader, Environment, FileSystemLoader, PrefixLoader
 
-from .builder import BuildHandler, DefaultCourseImageHandler
+from .builder import BuildHandler, DefaultCourseImageHandler, PrePullHandler
 from .images import ImagesHandler
 from .logs import LogsHandler
+from .registry import Registry
 
 
 class CwhRepo2DockerApplication(Application):
@@ -99,6 +101,9 @@ class CwhRepo2DockerApplication(Application):
                 (url_path_join(
                     service_prefix, 'api/environments/default-course-image'),
                     DefaultCourseImageHandler),
+                (url_path_join(
+                    service_prefix, 'api/environments/prepull'),
+                    PrePullHandler),
                 (url_path_join(
                     service_prefix, r'api/environments/([^/]+)/logs'),
                     LogsHandler),
@@ -122,6 +127,15 @@ class CwhRepo2DockerApplication(Application):
             return
         if self.http_server:
             self.http_server.stop()
+        self.io_loop.add_callback(self.shutdown)
+
+    async def cleanup(self):
+        if Registry.initialized():
+            await Registry.instance().close()
+
+    async def shutdown(self):
+        await self.cleanup()
+        self.io_loop.stop()
 
     async def launch_instance_async(self, argv=None):
         try:
@@ -143,10 +157,13 @@ def main():
         loop.close()
         raise
 
+    loop.asyncio_loop.add_signal_handler(signal.SIGTERM, app.stop)
+
     try:
         loop.start()
     except KeyboardInterrupt:
         print("\nInterrupted")
+        loop.run_sync(app.cleanup)
     finally:
         loop.stop()
         loop.close()
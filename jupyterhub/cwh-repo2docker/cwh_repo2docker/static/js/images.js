@@ -89,23 +89,43 @@ require([
       });
     });
 
-  $(".remove-environment").click(function() {
-    var el = $(this);
-    var row = getRow(el);
-    var image = row.data("image");
-    var name = row.data("display-name");
+  function showRemoveDialog(rows) {
+    var images = rows.map(function() {
+      return $(this).data("image");
+    }).get();
+    var names = rows.map(function() {
+      return $(this).data("display-name");
+    }).get();
     var dialog = $("#remove-environment-dialog");
-    dialog.find(".delete-environment").attr("data-image", image);
-    dialog.find(".delete-environment").text(name);
+    dialog.data("images", images);
+    dialog.find(".delete-environment").text(names.join("\n"));
     var modal = new bootstrap.Modal(dialog[0])
     modal.show();
+  }
+
+  $(".remove-environment").click(function() {
+    showRemoveDialog(getRow($(this)));
+  });
+
+  $(".select-environment").change(function() {
+    $("#remove-selected-environments").toggleClass(
+      "disabled", $(".select-environment:checked").length === 0);
+  });
+
+  $("#remove-selected-environments").click(function() {
+    var rows = $(".select-environment:checked").map(function() {
+      return getRow($(this))[0];
+    });
+    if (rows.length > 0) {
+      showRemoveDialog(rows);
+    }
   });
 
   $("#remove-environment-dialog")
     .find(".remove-button")
     .click(function() {
       var dialog = $("#remove-environment-dialog");
-      var image = dialog.find(".delete-environment").data("image");
+      var images = dialog.data("images");
       var spinner = $("#removing-environment-dialog");
       spinner.find('.modal-footer').remove();
       var modal = new bootstrap.Modal(spinner[0])
@@ -113,9 +133,19 @@ require([
       $.ajax("api/environments?_xsrf=" + xsrf_token, {
         type: "DELETE",
         data: JSON.stringify({
-          name: image
+          names: images
         }),
-        success: function() {
+        // 207 if some environments were removed, 500 if none were
+        complete: function(xhr) {
+          var results = (xhr.responseJSON || {}).results || [];
+          var failed = results.filter(function(result) {
+            return result.status !== "ok";
+          }).map(function(result) {
+            return result.name + ": " + result.message;
+          });
+          if (failed.length > 0) {
+            alert("Failed to remove environments:\n" + failed.join("\n"));
+          }
           window.location.reload();
         },
       })
@@ -174,6 +204,49 @@ require([
     modal.show();
   });
 
+  function showPrePullStatus(prepulls) {
+    var panel = $("#prepull-status");
+    panel.empty();
+    var running = false;
+    prepulls.forEach(function(prepull) {
+      var states = Object.values(prepull.nodes);
+      var done = states.filter(function(state) {
+        return state === "done";
+      }).length;
+      var failed = states.filter(function(state) {
+        return state !== "done" && state !== "waiting" && state !== "pulling";
+      }).length;
+      var finished = prepull.finished !== null;
+      running = running || !finished;
+      var text = "Pulling " + prepull.image + " on nodes: " +
+        done + "/" + states.length + " done";
+      if (failed > 0) {
+        text += ", " + failed + " failed";
+      }
+      if (!finished) {
+        text += " (in progress)";
+      }
+      var item = $("<p>").addClass(failed > 0 ? "text-danger" : "text-muted");
+      item.text(text);
+      item.attr("title", JSON.stringify(prepull.nodes, null, 1));
+      panel.append(item);
+    });
+    return running;
+  }
+
+  function updatePrePullStatus() {
+    $.ajax("api/environments/prepull?_xsrf=" + xsrf_token, {
+      type: "GET",
+      success: function(data) {
+        if (showPrePullStatus(data.prepulls)) {
+          setTimeout(updatePrePullStatus, 5000);
+        }
+      },
+    });
+  }
+
+  updatePrePullStatus();
+
   // initialize tooltips
   $('[data-toggle="tooltip"]').tooltip();
 
@@ -0,0 +1,195 @@
+import asyncio
+import uuid
+
+from docker.errors import APIError
+from docker.types import (
+    ContainerSpec,
+    TaskTemplate,
+)
+from tornado.log import app_log
+
+
+WARM_POOL_LABEL = 'cwh_repo2docker.warm_pool'
+
+
+class WarmPool:
+    """
+    Pool of placeholder Swarm services for course images.
+
+    A placeholder service runs the course image with `command` instead of
+    the single-user server, so that a node has pulled and unpacked the image
+    before a user asks for it.  A spawner claims a placeholder by updating
+    the service with the user's task spec, pinned to the node of the
+    placeholder task.  Swarm replaces the placeholder task with the user's
+    task, which skips the service creation and the image pull.
+
+    Swarm cannot change the environment, mounts or user of a running
+    container, so the single-user server still boots in a new container.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def __init__(
+            self,
+            docker,
+            sizes,
+            network_name='',
+            placement=None,
+            command=('sleep', 'infinity'),
+            refill_interval=30.0,
+            auth=None,
+            log=None):
+        self.docker = docker
+        self.sizes = dict(sizes)
+        self.network_name = network_name
+        self.placement = placement
+        self.command = list(command)
+        self.refill_interval = refill_interval
+        # `login` arguments for the registry of the images
+        self.auth = auth
+        self.log = log or app_log
+        self._logged_in = False
+        self._claimed = set()
+        self._refill_task = None
+
+    def start(self):
+        if self._refill_task is None and self.sizes:
+            self._refill_task = asyncio.ensure_future(self._refill_loop())
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                self.log.exception('failed to refill warm pool')
+            await asyncio.sleep(self.refill_interval)
+
+    async def _login(self, reauth=False):
+        if self.auth is None or (self._logged_in and not reauth):
+            return
+        await self.docker('login', reauth=True, **self.auth)
+        self._logged_in = True
+
+    async def _call_with_auth(self, method, *args, **kwargs):
+        """
+        Call a method that pulls the image of a task, logged in to the
+        registry, so that the client sends the credentials to the nodes.
+        """
+        await self._login()
+        try:
+            return await self.docker(method, *args, **kwargs)
+        except APIError as e:
+            if e.status_code != 401:
+                raise
+            self.log.warning('registry authentication failed: %s', e)
+            await self._login(reauth=True)
+            return await self.docker(method, *args, **kwargs)
+
+    async def _list(self, image=None):
+        label = WARM_POOL_LABEL if image is None else f'{WARM_POOL_LABEL}={image}'
+        return await self.docker('services', filters={'label': label})
+
+    async def refill(self):
+        services = await self._list()
+        pooled = {}
+        for service in services:
+            image = service['Spec']['Labels'][WARM_POOL_LABEL]
+            pooled.setdefault(image, []).append(service)
+        self._claimed &= {s['ID'] for s in services}
+
+        for image, size in self.sizes.items():
+            available = [s for s in pooled.get(image, [])
+                         if s['ID'] not in self._claimed]
+            for _ in range(size - len(available)):
+                await self._create(image)
+            for service in available[size:]:
+                if service['ID'] not in self._claimed:
+                    await self._remove(service)
+
+        for image, services in pooled.items():
+            if image not in self.sizes:
+                for service in services:
+                    if service['ID'] not in self._claimed:
+                        await self._remove(service)
+
+    async def _create(self, image):
+        name = 'cwh-warm-{}'.format(uuid.uuid4().hex[:12])
+        self.log.info('creating warm pool service %s for %s', name, image)
+        task_template = TaskTemplate(
+            container_spec=ContainerSpec(image=image, command=self.command),
+            networks=[self.network_name] if self.network_name else [],
+            placement=self.placement)
+        await self._call_with_auth(
+            'create_service',
+            task_template=task_template,
+            name=name,
+            labels={WARM_POOL_LABEL: image})
+
+    async def _remove(self, service):
+        self.log.info('removing warm pool service %s', service['Spec']['Name'])
+        await self.docker('remove_service', service['ID'])
+
+    async def claim(self, image):
+        """
+        Take a placeholder service of `image` out of the pool.
+
+        Returns the service, or None if the pool has no service of the image.
+        """
+        if image not in self.sizes:
+            return None
+        for service in await self._list(image):
+            if service['ID'] not in self._claimed:
+                self._claimed.add(service['ID'])
+                return service
+        return None
+
+    async def discard(self, service):
+        """
+        Remove a claimed service that could not be bound.
+        """
+        try:
+            await self._remove(service)
+        finally:
+            self._claimed.discard(service['ID'])
+
+    async def _get_node(self, service):
+        tasks = await self.docker(
+            'tasks',
+            filters={'service': service['ID'], 'desired-state': 'running'})
+        for task in tasks:
+            if task.get('Status', {}).get('State') == 'running':
+                return task.get('NodeID')
+        return None
+
+    async def bind(self, service, **create_kwargs):
+        """
+        Replace the placeholder task of a claimed service by the task
+        described by the `create_service` arguments of a spawner.
+
+        The task is pinned to the node of the placeholder task, replacing
+        any other node pin.  Returns the service ID and the node ID, which
+        is None if the placeholder task is not running.
+        """
+        create_kwargs.pop('name', None)
+        node_id = await self._get_node(service)
+        if node_id is not None:
+            task_template = create_kwargs['task_template']
+            placement = task_template.get('Placement') or {}
+            constraints = [c for c in placement.get('Constraints') or []
+                           if not c.startswith('node.id==')]
+            constraints.append(f'node.id=={node_id}')
+            task_template['Placement'] = dict(placement,
+                                              Constraints=constraints)
+        await self._call_with_auth(
+            'update_service',
+            service['ID'],
+            service['Version']['Index'],
+            name=service['Spec']['Name'],
+            **create_kwargs)
+        return {'ID': service['ID'], 'NodeID': node_id}
@@ -13,7 +13,8 @@ setup_args = dict(
         "coursewareuserspawner",
         "jupyterhub~=5.0",
         "aiodocker",
-        'aiohttp']
+        'aiohttp',
+        'PyYAML']
 )
 
 
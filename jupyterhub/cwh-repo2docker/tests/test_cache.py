@@ -0,0 +1,13 @@
+from cwh_repo2docker.cache import DigestCache
+
+DIGEST = 'sha256:' + 'a' * 64
+
+
+def test_unusable_directory_falls_back_to_memory(tmp_path):
+    path = tmp_path / 'file'
+    path.write_text('')
+    cache = DigestCache(10, str(path / 'configs'))
+    assert cache.directory is None
+
+    cache.put(DIGEST, {'a': 1})
+    assert cache.get(DIGEST) == {'a': 1}
@@ -0,0 +1,25 @@
+import os
+from unittest import mock
+
+from cwh_repo2docker import Repo2DockerSpawner
+
+
+def _spawner(users_dir):
+    spawner = mock.Mock(users_dir=users_dir, admin_data_dir='',
+                        course_dir='course-a')
+    spawner.user.name = 'a'
+    spawner.user.admin = False
+    spawner._get_home_dirs = \
+        lambda: Repo2DockerSpawner._get_home_dirs(spawner)
+    return spawner
+
+
+def test_changed_mode_is_not_provisioned(tmp_path):
+    spawner = _spawner(str(tmp_path))
+    course_dir = tmp_path / 'a' / 'course-a'
+    course_dir.mkdir(parents=True)
+    os.chmod(course_dir, 0o755)
+    assert Repo2DockerSpawner._dirs_provisioned(spawner)
+
+    os.chmod(course_dir, 0o700)
+    assert not Repo2DockerSpawner._dirs_provisioned(spawner)
@@ -0,0 +1,30 @@
+import cwh_repo2docker
+from cwh_repo2docker import (
+    _get_local_image_config,
+    _local_image_config_key,
+    _put_local_image_config,
+)
+from cwh_repo2docker.catalog import ImageConfig
+
+
+def test_tags_are_not_cache_keys():
+    assert _local_image_config_key('course-a:latest') is None
+    assert _local_image_config_key('host/course-a@sha256:abc') == \
+        'host/course-a@sha256:abc'
+    assert _local_image_config_key('sha256:abc') == 'sha256:abc'
+
+
+def test_local_image_configs_are_bounded(monkeypatch):
+    monkeypatch.setattr(cwh_repo2docker, '_local_image_configs_max', 2)
+    monkeypatch.setattr(cwh_repo2docker, '_local_image_configs',
+                        cwh_repo2docker.OrderedDict())
+    configs = [ImageConfig(cmd=[str(i)], entrypoint=None, labels={})
+               for i in range(3)]
+    _put_local_image_config('sha256:0', configs[0])
+    _put_local_image_config('sha256:1', configs[1])
+    assert _get_local_image_config('sha256:0') is configs[0]
+    _put_local_image_config('sha256:2', configs[2])
+
+    assert _get_local_image_config('sha256:1') is None
+    assert _get_local_image_config('sha256:0') is configs[0]
+    assert _get_local_image_config('sha256:2') is configs[2]
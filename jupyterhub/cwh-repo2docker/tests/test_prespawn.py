@@ -0,0 +1,105 @@
+import asyncio
+import io
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import jsonschema
+
+from cwh_repo2docker.prespawn import (
+    Lecture,
+    PreSpawnApplication,
+    lecture_starts,
+    load_schedule,
+)
+
+SCHEMA = os.path.join(os.path.dirname(__file__), '..', '..',
+                      'prespawn-schema.json')
+
+JST = timezone(timedelta(hours=9))
+
+
+def test_unquoted_timestamp():
+    schedule = load_schedule(io.StringIO(
+        'lectures:\n'
+        '  - course: course-a\n'
+        '    group: class-a\n'
+        '    start: 2026-04-10T10:40:00+09:00\n'))
+    with open(SCHEMA) as f:
+        jsonschema.validate(schedule, json.load(f))
+
+    entry = schedule['lectures'][0]
+    assert lecture_starts(entry, datetime.now(JST), JST) == \
+        [datetime(2026, 4, 10, 10, 40, tzinfo=JST)]
+
+
+def _app(**kwargs):
+    app = PreSpawnApplication(**kwargs)
+    app._handled = set()
+    app._progress = {}
+    app._prespawned = {}
+    app._prespawn_tasks = {}
+    app._semaphore = asyncio.Semaphore(2)
+    app.registry = mock.Mock()
+    return app
+
+
+def _lecture():
+    start = datetime.now(JST)
+    return Lecture('course-a', 'class-a', start, 0, 1800, None)
+
+
+def test_failed_spawns_do_not_stop_the_others():
+    app = _app()
+    app.api_request = mock.AsyncMock(
+        return_value={'users': ['a', 'b', 'c']})
+    spawned = []
+
+    async def spawn(name, lecture, options):
+        if name == 'a':
+            raise ConnectionResetError()
+        spawned.append(name)
+    app.spawn = spawn
+
+    asyncio.run(app.prespawn(_lecture()))
+    assert spawned == ['b', 'c']
+
+
+def test_state_is_kept_across_restarts(tmp_path):
+    state_file = str(tmp_path / 'prespawn.json')
+    lecture = _lecture()
+    app = _app(state_file=state_file)
+    app._handled.add((lecture.course, lecture.group, lecture.start))
+    app._prespawned[('a', lecture.course)] = lecture.start
+    app.save_state()
+
+    restarted = _app(state_file=state_file)
+    restarted.load_state()
+    assert restarted._handled == app._handled
+    assert restarted._prespawned == app._prespawned
+
+
+def test_restart_spawns_the_remaining_users(tmp_path):
+    state_file = str(tmp_path / 'prespawn.json')
+    lecture = _lecture()
+    app = _app(state_file=state_file)
+    app.api_request = mock.AsyncMock(side_effect=[{'servers': {}}, {}])
+    # the service stops after spawning a
+    asyncio.run(app.spawn('a', lecture, {}))
+
+    restarted = _app(state_file=state_file)
+    restarted.load_state()
+    restarted.api_request = mock.AsyncMock(
+        return_value={'users': ['a', 'b']})
+    spawned = []
+
+    async def spawn(name, lecture, options):
+        spawned.append(name)
+    restarted.spawn = spawn
+
+    asyncio.run(restarted.prespawn(lecture))
+    assert spawned == ['b']
+    assert restarted._handled == {
+        (lecture.course, lecture.group, lecture.start)}
+    assert restarted._progress == {}
@@ -0,0 +1,60 @@
+import asyncio
+
+from aiohttp import web
+
+from cwh_repo2docker.registry import Registry
+
+
+async def _delete_missing_image():
+    async def not_found(request):
+        return web.json_response(
+            {'errors': [{'code': 'MANIFEST_UNKNOWN'}]}, status=404)
+
+    app = web.Application()
+    app.router.add_get('/v2/{name}/manifests/{ref}', not_found)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    registry = Registry(host=f'127.0.0.1:{port}', insecure=True)
+    try:
+        errors = await registry.delete_images([('course-a', 'nope')])
+        # a missing image is already deleted
+        await registry.delete_image('course-a', 'nope')
+        return errors
+    finally:
+        await registry._get_session().close()
+        await runner.cleanup()
+
+
+def test_delete_missing_image():
+    errors = asyncio.run(_delete_missing_image())
+    assert isinstance(errors[0], LookupError)
+    assert str(errors[0]) == "image not found: 'course-a:nope'"
+
+
+async def _shared_invalidation(cache_dir):
+    hub = Registry(host='registry', cache_dir=cache_dir)
+    service = Registry(host='registry', cache_dir=cache_dir)
+    listings = [[{'image_name': 'course-a:1', 'manifest_digest': 'sha256:a',
+                  'default_course_image': False}]]
+
+    async def fetch_images():
+        return listings[-1]
+
+    hub._fetch_images = fetch_images
+    service._fetch_images = fetch_images
+    assert len(await hub.list_images()) == 1
+
+    listings.append(listings[0] + [
+        {'image_name': 'course-b:1', 'manifest_digest': 'sha256:b',
+         'default_course_image': False}])
+    assert len(await hub.list_images()) == 1
+    service.invalidate_catalog()
+    return await hub.list_images()
+
+
+def test_invalidation_is_shared_through_cache_dir(tmp_path):
+    images = asyncio.run(_shared_invalidation(str(tmp_path)))
+    assert [i['image_name'] for i in images] == ['course-a:1', 'course-b:1']
@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import json
+
+import docker
+from aiohttp import web
+from coursewareuserspawner.dockerapi import DockerAPI
+from docker.types import ContainerSpec, Placement, TaskTemplate
+
+from cwh_repo2docker.warmpool import WarmPool
+
+
+class FakeDocker:
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.calls = []
+
+    async def __call__(self, method, *args, **kwargs):
+        self.calls.append((method, args, kwargs))
+        if method == 'tasks':
+            return self.tasks
+        return None
+
+
+def test_bind_pins_the_placeholder_node():
+    docker = FakeDocker([
+        {'NodeID': 'node-old', 'Status': {'State': 'shutdown'}},
+        {'NodeID': 'node-a', 'Status': {'State': 'running'}},
+    ])
+    pool = WarmPool(docker=docker, sizes={'course-a:latest': 1})
+    service = {'ID': 'svc', 'Version': {'Index': 3},
+               'Spec': {'Name': 'cwh-warm-abc'}}
+    task_template = TaskTemplate(
+        container_spec={'Image': 'course-a:latest'},
+        placement=Placement(constraints=['node.role==worker',
+                                         'node.id==node-b']))
+
+    result = asyncio.run(pool.bind(service, name='jupyter-a',
+                                   task_template=task_template))
+
+    assert result == {'ID': 'svc', 'NodeID': 'node-a'}
+    method, args, kwargs = docker.calls[-1]
+    assert method == 'update_service'
+    assert args == ('svc', 3)
+    assert kwargs['name'] == 'cwh-warm-abc'
+    assert kwargs['task_template']['Placement']['Constraints'] == \
+        ['node.role==worker', 'node.id==node-a']
+
+
+async def _create_and_bind(image):
+    requests = []
+
+    async def login(request):
+        requests.append(('login', dict(request.headers)))
+        return web.json_response({'Status': 'Login Succeeded'})
+
+    async def create(request):
+        requests.append(('create', dict(request.headers)))
+        return web.json_response({'ID': 'svc'})
+
+    async def update(request):
+        requests.append(('update', dict(request.headers)))
+        return web.json_response({})
+
+    async def tasks(request):
+        return web.json_response([])
+
+    app = web.Application()
+    app.router.add_post('/v1.41/auth', login)
+    app.router.add_post('/v1.41/services/create', create)
+    app.router.add_post('/v1.41/services/{id}/update', update)
+    app.router.add_get('/v1.41/tasks', tasks)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    client = docker.APIClient(base_url=f'tcp://127.0.0.1:{port}',
+                              version='1.41')
+    pool = WarmPool(
+        docker=DockerAPI(client),
+        sizes={image: 1},
+        auth=dict(username='user', password='secret',
+                  registry='https://registry.example.com:5000/v2/'))
+    try:
+        await pool._create(image)
+        service = {'ID': 'svc', 'Version': {'Index': 1},
+                   'Spec': {'Name': 'cwh-warm-abc'}}
+        await pool.bind(service, task_template=TaskTemplate(
+            container_spec=ContainerSpec(image=image)))
+    finally:
+        await runner.cleanup()
+    return requests
+
+
+def test_placeholders_are_created_and_bound_with_registry_auth():
+    image = 'registry.example.com:5000/course-a:latest'
+    requests = asyncio.run(_create_and_bind(image))
+
+    assert [name for name, _ in requests] == ['login', 'create', 'update']
+    for name, headers in requests[1:]:
+        auth = json.loads(base64.urlsafe_b64decode(
+            headers['X-Registry-Auth']))
+        assert auth['username'] == 'user'
+        assert auth['password'] == 'secret'
@@ -8,4 +8,9 @@ c.Registry.default_course_image = os.environ.get('CONTAINER_IMAGE', 'coursewareh
 c.Registry.host = registry_host
 c.Registry.username = os.environ.get('REGISTRY_USER', 'cwh')
 c.Registry.password = os.environ['REGISTRY_PASSWORD']
+c.Registry.cache_dir = os.environ.get('REGISTRY_CACHE_DIR', '/var/cache/cwh-repo2docker')
 
+if 'SPAWNER_CONSTRAINTS' in os.environ:
+    c.PrePuller.constraints = [
+        x.strip() for x in os.environ['SPAWNER_CONSTRAINTS'].split(';')
+    ]
@@ -4,9 +4,11 @@ import yaml
 import json
 import jsonschema
 from docker.types import (RestartPolicy, Placement)
+from coursewareuserspawner.provision import ProvisionUsersAPIHandler
 from coursewareuserspawner.traitlets import ResourceAllocation
 from cwh_authenticator import CoursewareHubRemoteUserLocalAuthenticator
 from cwh_repo2docker import cwh_repo2docker_jupyterhub_config
+from cwh_repo2docker.prespawn import load_schedule
 
 
 # Configuration file for jupyterhub.
@@ -30,7 +32,10 @@ c.JupyterHub.allow_named_servers = True
 ## Configure authenticator
 c.JupyterHub.authenticator_class = CoursewareHubRemoteUserLocalAuthenticator
 c.LocalAuthenticator.create_system_users = True
-c.LocalAuthenticator.add_user_cmd = ["/get_user_id.sh"]
+
+# admin API to provision users of a roster before lectures
+c.JupyterHub.extra_handlers.append(
+    (r'/api/courseware/provision', ProvisionUsersAPIHandler))
 
 c.JupyterHub.logo_file = '/var/jupyterhub/logo.png'
 
@@ -42,6 +47,9 @@ if 'SPAWNER_HTTP_TIMEOUT' in os.environ:
     c.Spawner.http_timeout = int(os.environ['SPAWNER_HTTP_TIMEOUT'])
 if 'SPAWNER_START_TIMEOUT' in os.environ:
     c.Spawner.start_timeout = int(os.environ['SPAWNER_START_TIMEOUT'])
+# the hub serves requests while servers left after the timeout are checked
+if 'INIT_SPAWNERS_TIMEOUT' in os.environ:
+    c.JupyterHub.init_spawners_timeout = int(os.environ['INIT_SPAWNERS_TIMEOUT'])
 
 if 'CPU_LIMIT' in os.environ:
     c.Spawner.cpu_limit = float(os.environ['CPU_LIMIT'])
@@ -105,6 +113,22 @@ if 'SPAWNER_CONSTRAINTS' in os.environ:
     })
 c.SwarmSpawner.extra_task_spec = extra_task_spec
 
+# servers are also polled on Docker events, so polling can be infrequent
+if 'SPAWNER_POLL_INTERVAL' in os.environ:
+    c.Spawner.poll_interval = int(os.environ['SPAWNER_POLL_INTERVAL'])
+
+# scale stopped (e.g. culled) servers to 0 replicas instead of removing them
+if os.environ.get('SPAWNER_SUSPEND', 'no') in ('yes', '1'):
+    c.CoursewareUserSpawner.suspend_on_stop = True
+
+# e.g. WARM_POOL_SIZES='{"course-a:latest": 10}'
+if 'WARM_POOL_SIZES' in os.environ:
+    c.Repo2DockerSpawner.warm_pool_sizes = json.loads(os.environ['WARM_POOL_SIZES'])
+
+# off, prefer or strict
+if 'SPAWNER_IMAGE_LOCALITY' in os.environ:
+    c.Repo2DockerSpawner.image_locality = os.environ['SPAWNER_IMAGE_LOCALITY']
+
 if 'JUPYTERHUB_SINGLEUSER_APP' in os.environ:
     c.Spawner.environment = {
         'JUPYTERHUB_SINGLEUSER_APP': os.environ['JUPYTERHUB_SINGLEUSER_APP']
@@ -176,7 +200,9 @@ cwh_repo2docker_environ_names = [
     'CONTAINER_IMAGE',
     'REGISTRY_HOST',
     'REGISTRY_USER',
-    'REGISTRY_PASSWORD'
+    'REGISTRY_PASSWORD',
+    'REGISTRY_CACHE_DIR',
+    'SPAWNER_CONSTRAINTS'
 ]
 
 service_environments = {}
@@ -193,6 +219,52 @@ cwh_repo2docker_jupyterhub_config(
     debug=debug_log)
 load_subconfig(cwh_repo2docker_config_path)
 
+## pre-spawn course servers before lectures
+if 'PRESPAWN_SCHEDULE_FILE' in os.environ:
+    prespawn_schedule_file = os.environ['PRESPAWN_SCHEDULE_FILE']
+    if not os.path.exists(prespawn_schedule_file):
+        raise ValueError('Pre-spawn schedule file not found: %s' %
+                         prespawn_schedule_file)
+    with open('prespawn-schema.json') as f:
+        prespawn_schedule_schema = json.load(f)
+    with open(prespawn_schedule_file) as f:
+        jsonschema.validate(load_schedule(f), prespawn_schedule_schema)
+
+    c.JupyterHub.load_roles.append(
+        {
+            "name": "prespawn-role",
+            "scopes": [
+                "read:groups",
+                "read:users",
+                "read:servers",
+                "servers",
+            ],
+            "services": ["prespawn"],
+        }
+    )
+    prespawn_command = [
+        sys.executable,
+        '-m', 'cwh_repo2docker.prespawn',
+        '--config-file', cwh_repo2docker_config_path,
+        '--schedule-file', prespawn_schedule_file,
+    ]
+    # keep track of pre-spawned servers across restarts of the service
+    if 'PRESPAWN_STATE_FILE' in os.environ:
+        prespawn_command.extend([
+            '--state-file', os.environ['PRESPAWN_STATE_FILE']
+        ])
+    if 'PRESPAWN_CONCURRENCY' in os.environ:
+        prespawn_command.extend([
+            '--concurrency', os.environ['PRESPAWN_CONCURRENCY']
+        ])
+    c.JupyterHub.services.append(
+        {
+            'name': 'prespawn',
+            'command': prespawn_command,
+            'environment': service_environments,
+        }
+    )
+
 # debug log
 if debug_log:
     c.JupyterHub.log_level = 'DEBUG'
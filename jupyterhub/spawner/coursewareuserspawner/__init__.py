@@ -1,32 +1,47 @@
+import asyncio
 import os
+import time
 from copy import copy
+from datetime import datetime, timezone
+from pprint import pformat
 
 from dockerspawner import SwarmSpawner
-from docker.types import Mount
+from docker.errors import APIError
+from docker.types import Mount, ServiceMode
 from textwrap import dedent
 from traitlets import (
     Any,
+    Bool,
+    Float,
     Integer,
     Unicode,
     List,
     Dict,
     Tuple,
-    default
+    default,
+    observe
 )
+from .dockerapi import DockerAPI, make_client
+from .events import SwarmEvents
+from .metrics import SpawnPhase, observe_phase, time_phase
+from .resources import ResourceTable
+from .restuser import RestUserClient, user_ids
+from .snapshot import SPAWNER_LABEL, SwarmSnapshot
 from .traitlets import ResourceAllocationTrait
+from jupyterhub.utils import (
+    make_ssl_context,
+    url_path_join,
+    wait_for_http_server
+)
 from tornado import gen
-import requests_unixsocket
 
 
-def get_user_id_default(spawner):
+async def get_user_id_default(spawner):
     """
     Get user ID via restuser service that runs on a master node.
     """
-    session = requests_unixsocket.Session()
-    r = session.post(
-        'http+unix://%2Fvar%2Frun%2Frestuser.sock/{}'.format(spawner.user.name)
-    )
-    return r.json()['uid']
+    client = RestUserClient.instance(spawner.restuser_socket_path)
+    return await client.get_uid(spawner.user.name)
 
 
 class CoursewareUserSpawner(SwarmSpawner):
@@ -64,9 +79,10 @@ class CoursewareUserSpawner(SwarmSpawner):
             If system users are being used, then we need to know their user id
             in order to mount the home directory.
 
-            User IDs are looked up in two ways:
+            User IDs are looked up in three ways:
             1. stored in the state dict (authenticator can write here)
-            2. lookup via get_user_id function
+            2. cached by the hub for the user
+            3. lookup via get_user_id function when the server starts
             """
         )
     )
@@ -217,7 +233,8 @@ class CoursewareUserSpawner(SwarmSpawner):
             """
             An optional function that returns a user ID of a single-user
             notebook server in order to mount the home directory.
-            The function takes a spawner object argument and returns a user ID.
+            The function takes a spawner object argument and returns a user ID
+            or an awaitable of it.
 
             The default function calls restuser service via UNIX domain socket
             and returns the user ID.
@@ -226,6 +243,26 @@ class CoursewareUserSpawner(SwarmSpawner):
         )
     )
 
+    restuser_socket_path = Unicode(
+        "/var/run/restuser.sock",
+        config=True,
+        help="Path of the UNIX domain socket of restuser service"
+    )
+
+    slow_spawn_phase_threshold = Float(
+        10.0,
+        config=True,
+        help=dedent(
+            """
+            Duration in seconds above which a spawn phase is logged as slow.
+            Set to 0 to disable the logging.
+
+            The durations of all phases are exported as
+            `spawn_phase_duration_seconds` histogram in the hub's metrics.
+            """
+        )
+    )
+
     group_resources = Dict(
         config=True,
         key_trait=Unicode,
@@ -318,6 +355,49 @@ class CoursewareUserSpawner(SwarmSpawner):
         help="Path of admin data directory"
     )
 
+    swarm_snapshot_interval = Float(
+        10.0,
+        config=True,
+        help=dedent(
+            """
+            Interval in seconds between refreshes of the hub-wide snapshot
+            of single-user services and tasks, which `poll()` answers from.
+            Set to 0 to poll each service via the Docker API.
+            """
+        )
+    )
+
+    swarm_events = Bool(
+        True,
+        config=True,
+        help=dedent(
+            """
+            Subscribe to Docker events to poll a server as soon as its service
+            changes or its container dies, instead of at the next poll.
+            Container events are reported only by the Docker daemon of the
+            hub's manager node, so that a container that dies on another
+            node is noticed by the service update or the next poll.
+            """
+        )
+    )
+
+    suspend_on_stop = Bool(
+        False,
+        config=True,
+        help=dedent(
+            """
+            Suspend a stopped server instead of removing its service.
+
+            The service is scaled to 0 replicas, so that the server uses
+            no memory, and its next start scales it back to 1 replica
+            without creating a service.  Only servers that responded and
+            whose task is running are suspended.  The service is removed when the server is
+            deleted, if it cannot be suspended, or if the next start uses
+            another image.
+            """
+        )
+    )
+
     @property
     def mounts(self):
         mounts = []
@@ -430,58 +510,101 @@ class CoursewareUserSpawner(SwarmSpawner):
     @default('user_id')
     def _default_user_id(self):
         """
-        Get user_id via get_user_id function.
+        Get user_id cached by the hub or stored in the state of
+        another server of the user.
 
-        If the authenticator stores user_id in the user state dict,
-        this will never be called.
+        If it is unknown, user_id is looked up when the server starts.
         """
-        return self.get_user_id(self)
+        uid = user_ids.get(self.user.name)
+        if uid is None:
+            uid = self._get_sibling_user_id()
+        return uid if uid is not None else -1
+
+    def _get_sibling_user_id(self):
+        orm_user = getattr(self.user, 'orm_user', None)
+        if orm_user is None:
+            return None
+        for orm_spawner in orm_user.orm_spawners.values():
+            uid = (orm_spawner.state or {}).get('user_id')
+            if uid is not None:
+                user_ids.set(self.user.name, uid)
+                return uid
+        return None
+
+    _suspended = False
+    _suspended_node = None
+    _resume_service = None
 
     def load_state(self, state):
         super().load_state(state)
         if 'user_id' in state:
             self.user_id = state['user_id']
-        else:
-            self.user_id = self.get_user_id(self)
+            user_ids.set(self.user.name, self.user_id)
+        self._suspended = state.get('suspended', False)
+        self._suspended_node = state.get('suspended_node')
+
+    async def resolve_user_id(self):
+        """
+        Look up user_id via get_user_id function if it is unknown.
+        """
+        if self.user_id < 0:
+            self.user_id = await user_ids.resolve(
+                self.user.name, lambda: self.get_user_id(self))
+        return self.user_id
 
     def get_state(self):
         state = super().get_state()
         if self.user_id >= 0:
             state['user_id'] = self.user_id
+        if self._suspended:
+            state['suspended'] = True
+            if self._suspended_node:
+                state['suspended_node'] = self._suspended_node
         return state
 
+    def clear_state(self):
+        object_id = self.object_id
+        super().clear_state()
+        if self._suspended:
+            # keep track of the suspended service to resume it
+            self.object_id = object_id
+
+    _resource_table = None
+
+    # the shared table as of the spawner's resource settings,
+    # looked up once per change of the settings instead of once per call
+    _spawner_resource_table = None
+
+    @observe('group_resources', 'default_resources', 'admin_resources')
+    def _resource_settings_changed(self, change):
+        self._spawner_resource_table = None
+
+    def _get_resource_table(self):
+        table = self._spawner_resource_table
+        if table is not None:
+            return table
+        cls = self.__class__
+        table = cls._resource_table
+        if table is None or not table.matches(self.group_resources,
+                                              self.default_resources,
+                                              self.admin_resources):
+            table = ResourceTable(self.group_resources,
+                                  self.default_resources,
+                                  self.admin_resources)
+            cls._resource_table = table
+        self._spawner_resource_table = table
+        return table
+
     def _get_resource_config(self, config_name):
-        resources = None
-        groups = [g.name for g in self.user.groups]
+        groups = frozenset(g.name for g in self.user.groups)
         admin = self._is_admin()
-        self.log.debug(('_get_resource_config: config=%s, '
-                        'user=%s, groups=%s, admin=%s'),
-                       config_name, self.user.name, str(groups), str(admin))
+        resources = self._get_resource_table().resolve(groups, admin)
 
-        if admin and self.admin_resources is not None:
-            resources = self.admin_resources
-        else:
-            config_list = self.group_resources.items()
-            config_list = [(g, c) for g, c in config_list
-                           if (g in groups and
-                               g != 'admin' and g != 'default' and
-                               c is not None)]
-            config_list = sorted(config_list, key=lambda x: x[1].priority)
-            if config_list:
-                resources = config_list[0][1]
-
-        if resources is None:
-            resources = self.default_resources
-
-        self.log.debug(('_get_resource_config result: config=%s, '
-                        'user=%s, groups=%s, admin=%s, resources=%s'),
-                       config_name, self.user.name, str(groups),
-                       str(admin), str(resources))
         config_value = None
         if resources is not None:
             config_value = getattr(resources, config_name)
-        self.log.debug('resource allocation: user=%s, %s=%s',
-                       self.user.name, config_name, config_value)
+        self.log.debug('resource allocation: user=%s, admin=%s, %s=%s',
+                       self.user.name, admin, config_name, config_value)
         return config_value
 
     @default('cpu_limit')
@@ -500,16 +623,321 @@ class CoursewareUserSpawner(SwarmSpawner):
     def _default_mem_guarantee(self):
         return self._get_resource_config('mem_guarantee')
 
+    async def start(self):
+        self._cancel_boot_timer()
+        self._responded = False
+        self._started_at = datetime.now(timezone.utc)
+        with time_phase(self, SpawnPhase.user_id):
+            await self.resolve_user_id()
+
+        service = None
+        if self._suspended:
+            service = await self._get_suspended_service()
+        if service is not None:
+            image_option = self.user_options.get('image')
+            if image_option:
+                self.image = await self.check_allowed(image_option)
+            if not self._can_resume(service):
+                self.log.info('Removing suspended service %s (id: %s)'
+                              ' of another image or name',
+                              service['Spec']['Name'], self.object_id[:7])
+                await self.remove_object()
+                self.object_id = ''
+                service = None
+        if service is not None:
+            ip_port = await self._resume(service)
+        else:
+            ip_port = await super().start()
+        self._suspended = False
+        self._suspended_node = None
+        self._boot_timer = asyncio.ensure_future(
+            self._time_boot(ip_port, time.perf_counter()))
+        return ip_port
+
+    async def _time_boot(self, ip_port, started):
+        """
+        Wait for the started server to respond like the hub does,
+        and record the time it took to boot.
+        """
+        ip, port = ip_port
+        proto = 'https' if self.internal_ssl else 'http'
+        url = url_path_join(
+            f'{proto}://{ip}:{port}', self.server.base_url, 'api')
+        settings = self.user.settings
+        ssl_context = make_ssl_context(
+            settings.get('internal_ssl_key'),
+            settings.get('internal_ssl_cert'),
+            cafile=settings.get('internal_ssl_ca'))
+        try:
+            await wait_for_http_server(
+                url, timeout=self.http_timeout, ssl_context=ssl_context)
+        except Exception:
+            # the hub gives up on the server as well
+            return
+        self._responded = True
+        observe_phase(self, SpawnPhase.boot, time.perf_counter() - started)
+
+    def _cancel_boot_timer(self):
+        if self._boot_timer is not None:
+            self._boot_timer.cancel()
+            self._boot_timer = None
+
+    async def _get_suspended_service(self):
+        try:
+            return await self.docker('inspect_service', self.object_id)
+        except APIError as e:
+            if e.response.status_code != 404:
+                raise
+            self.log.info('Suspended service %s is gone', self.service_name)
+            return None
+
+    def _can_resume(self, service):
+        """
+        Check whether the suspended service runs the image of this start
+        under the name of this start.  Other settings, e.g. resources,
+        are applied when the service is resumed.
+        """
+        spec = service['Spec']
+        image = spec['TaskTemplate']['ContainerSpec']['Image']
+        return (spec['Name'] == self.object_name and
+                image.partition('@')[0] == self.image)
+
+    async def _resume(self, service):
+        """
+        Scale the suspended service back to 1 replica with the task spec
+        of this start, e.g. with a new API token.
+        """
+        await self.pull_image(self.image)
+
+        self._resume_service = service
+        try:
+            await self.create_object()
+        finally:
+            self._resume_service = None
+        self.object_id = service['ID']
+        self.log.info('Resumed service %s (id: %s) from image %s',
+                      self.service_name, self.object_id[:7], self.image)
+
+        # wait for the new task, so that the shut down task is not taken
+        # for the state of the server
+        deadline = time.monotonic() + self.start_timeout
+        while not await self.docker(
+                'tasks',
+                filters={'service': self.object_id,
+                         'desired-state': 'running'}):
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(
+                    f'no task scheduled for resumed service'
+                    f' {self.service_name}')
+            await asyncio.sleep(0.5)
+
+        await self.start_object()
+
+        if self.post_start_cmd:
+            await self.post_start_exec()
+
+        return await self.get_ip_and_port()
+
+    def docker(self, method, *args, **kwargs):
+        if method == 'create_service' and self._resume_service is not None:
+            # the target is kept until _resume returns, so that a retried
+            # create_service, e.g. after a registry login, resumes it too
+            service = self._resume_service
+            kwargs.pop('name', None)
+            return super().docker(
+                'update_service',
+                service['ID'],
+                service['Version']['Index'],
+                name=service['Spec']['Name'],
+                mode=ServiceMode('replicated', replicas=1),
+                fetch_current_spec=True,
+                **kwargs)
+        return super().docker(method, *args, **kwargs)
+
+    async def stop(self, now=False):
+        self._cancel_boot_timer()
+        if self.suspend_on_stop and self.object_id:
+            if not self._responded:
+                self.log.info('Not suspending %s, which did not respond',
+                              self.service_name)
+            else:
+                try:
+                    suspended = await self._suspend()
+                except Exception:
+                    self.log.warning('Failed to suspend %s, removing it',
+                                     self.service_name, exc_info=True)
+                else:
+                    if suspended:
+                        self.clear_state()
+                        return
+        self._suspended = False
+        self._suspended_node = None
+        await super().stop(now)
+
+    async def _suspend(self):
+        """
+        Scale the service of a running server to 0 replicas.
+
+        Returns False without suspending if the task is not running,
+        e.g. if the server failed to start, so that the service is removed.
+        """
+        task = await self.get_task()
+        state = task['Status']['State'] if task else None
+        if state != 'running':
+            self.log.info('Not suspending %s with task state %s',
+                          self.service_name, state)
+            return False
+        service = await self.docker('inspect_service', self.object_id)
+        await self.docker(
+            'update_service',
+            service['ID'],
+            service['Version']['Index'],
+            mode=ServiceMode('replicated', replicas=0),
+            fetch_current_spec=True)
+        self._invalidate_snapshot()
+        self._suspended = True
+        self._suspended_node = task.get('NodeID')
+        self.log.info('Suspended service %s (id: %s)',
+                      self.service_name, self.object_id[:7])
+        return True
+
+    async def delete_forever(self):
+        if self._suspended and self.object_id:
+            try:
+                await self.remove_object()
+            except APIError as e:
+                if e.response.status_code != 404:
+                    raise
+            self._suspended = False
+            self._suspended_node = None
+            self.object_id = ''
+
+    _boot_timer = None
+    # whether the server responded after it was started by this spawner;
+    # a restored server responded to the hub
+    _responded = True
+
     @gen.coroutine
     def create_object(self):
         # systemuser image must be started as root
         # relies on NB_UID and NB_USER handling in docker-stacks
         self.extra_container_spec = {
             'workdir': self.format_string(self.workdir),
-            'user': '0'
+            'user': '0',
+            # label the containers for the Docker events filter
+            'labels': {SPAWNER_LABEL: self.user.name},
         }
-
-        return (yield super(CoursewareUserSpawner, self).create_object())
+        # label the service for the swarm snapshot
+        labels = dict(self.extra_create_kwargs.get('labels') or {})
+        labels[SPAWNER_LABEL] = self.user.name
+        self.extra_create_kwargs = dict(self.extra_create_kwargs, labels=labels)
+
+        try:
+            with time_phase(self, SpawnPhase.create_service):
+                return (yield super(CoursewareUserSpawner, self).create_object())
+        finally:
+            self._invalidate_snapshot()
+
+    def _invalidate_snapshot(self):
+        """
+        Check the service via the Docker API until the next refresh of
+        the swarm snapshot, after its tasks were changed.
+        """
+        if SwarmSnapshot._instance is not None:
+            SwarmSnapshot._instance.invalidate(self.service_name)
+
+    def _get_swarm_snapshot(self):
+        if not self.swarm_snapshot_interval:
+            return None
+        snapshot = SwarmSnapshot._instance
+        if snapshot is None:
+            snapshot = SwarmSnapshot.instance(
+                docker=DockerAPI.for_spawner(self),
+                interval=self.swarm_snapshot_interval,
+                log=self.log)
+        snapshot.start()
+        return snapshot
+
+    def start_polling(self):
+        super().start_polling()
+        if self.swarm_events:
+            events = SwarmEvents._instance
+            if events is None:
+                events = SwarmEvents.instance(
+                    client=make_client(self),
+                    snapshot=self._get_swarm_snapshot(),
+                    log=self.log)
+            events.start()
+            events.register(self)
+
+    def stop_polling(self):
+        super().stop_polling()
+        if SwarmEvents._instance is not None:
+            SwarmEvents._instance.unregister(self)
+
+    async def poll(self):
+        """
+        Answer from the swarm snapshot, or check the service via
+        the Docker API if it is not in the snapshot.
+        """
+        snapshot = self._get_swarm_snapshot()
+        service = None
+        if snapshot is not None and self.service_name:
+            try:
+                await snapshot.ensure_fresh()
+            except Exception:
+                self.log.warning('failed to refresh swarm snapshot',
+                                 exc_info=True)
+            service = snapshot.get_service(self.service_name, self.object_id)
+        if service is None:
+            return await super().poll()
+
+        try:
+            task = snapshot.get_task(service)
+        except LookupError:
+            return await super().poll()
+        if task is None or self._is_stale_task(task):
+            # the task of this start is not in the snapshot yet
+            return await super().poll()
+        self.object_id = service['ID']
+
+        task_state = task["Status"]
+        if task_state["State"] in {"running", "starting", "pending", "preparing"}:
+            return None
+        return pformat(task_state)
+
+    _started_at = None
+
+    def _is_stale_task(self, task):
+        """
+        Check whether a task that is not desired to be running was created
+        before the server was last started, e.g. the task shut down when
+        the service was suspended.
+        """
+        if self._started_at is None or task.get('DesiredState') == 'running':
+            return False
+        try:
+            created = datetime.fromisoformat(task['CreatedAt'])
+        except (KeyError, ValueError):
+            return False
+        return created < self._started_at
+
+    async def get_ip_and_port(self):
+        if not (self.use_internal_hostname or self.use_internal_ip):
+            snapshot = self._get_swarm_snapshot()
+            service = None
+            if snapshot is not None:
+                service = snapshot.get_service(
+                    self.service_name, self.object_id)
+            if service is not None:
+                for port_config in service.get('Endpoint', {}).get('Ports', []):
+                    if port_config.get('TargetPort') == self.port:
+                        return self.host_ip, port_config['PublishedPort']
+        return await super().get_ip_and_port()
+
+    async def start_object(self):
+        with time_phase(self, SpawnPhase.start_service):
+            return await super().start_object()
 
     def _is_admin(self):
         return self.user.admin
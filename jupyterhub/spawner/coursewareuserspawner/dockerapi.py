@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+from docker.utils import kwargs_from_env
+
+
+def make_client(spawner):
+    """
+    Create a Docker API client configured like the spawners' shared client.
+    """
+    kwargs = {'version': 'auto'}
+    if spawner.tls_config:
+        kwargs['tls'] = docker.tls.TLSConfig(**spawner.tls_config)
+    kwargs.update(kwargs_from_env())
+    kwargs.update(spawner.client_kwargs)
+    return docker.APIClient(**kwargs)
+
+
+class DockerAPI:
+    """
+    Docker API client with a worker thread of its own.
+
+    Hub-wide components call the Docker API through their own client,
+    so that they do not depend on the spawner that created them, and
+    their listings do not queue behind spawners on the spawners' thread.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.executor = ThreadPoolExecutor(1)
+
+    @classmethod
+    def for_spawner(cls, spawner):
+        return cls(make_client(spawner))
+
+    def __call__(self, method, *args, **kwargs):
+        """
+        Call a Docker API method in the worker thread and return a Future.
+        """
+        return asyncio.wrap_future(self.executor.submit(
+            getattr(self.client, method), *args, **kwargs))
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+from tornado.log import app_log
+
+from .snapshot import SPAWNER_LABEL
+
+
+# Docker combines the filters of different keys with AND, and service and
+# node events carry no labels, so that the containers of single-user
+# servers are subscribed to in a stream of their own
+EVENT_FILTERS = [
+    {
+        'type': ['container'],
+        'event': ['die', 'oom'],
+        'label': [SPAWNER_LABEL],
+    },
+    {
+        'type': ['service', 'node'],
+        'event': ['remove', 'update'],
+    },
+]
+
+
+class SwarmEvents:
+    """
+    Subscriber to the Docker events of single-user servers.
+
+    When a service of a running server changes or is removed, or a
+    container of it dies, the swarm snapshot is refreshed and the server's
+    spawner is polled at once, so that the hub notices a dead server
+    without waiting for the next poll.  A node event polls all servers.
+
+    Container events are reported only by the daemon that runs the
+    container, i.e. the local daemon of the manager the hub talks to,
+    so that a container that dies on another node is noticed by the
+    service update or the next poll.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def __init__(self, client, snapshot=None, delay=0.5, log=None):
+        self.client = client
+        self.snapshot = snapshot
+        self.delay = delay
+        self.log = log or app_log
+        self._spawners = {}
+        self._pending = set()
+        self._pending_all = False
+        self._flush_handle = None
+        self._loop = None
+        self._threads = []
+
+    def start(self):
+        if not self._threads:
+            self._loop = asyncio.get_running_loop()
+            for filters in EVENT_FILTERS:
+                thread = threading.Thread(
+                    target=self._watch, args=(filters,),
+                    name='cwh-swarm-events', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def register(self, spawner):
+        self._spawners[spawner.service_name] = spawner
+
+    def unregister(self, spawner):
+        if self._spawners.get(spawner.service_name) is spawner:
+            del self._spawners[spawner.service_name]
+
+    def _watch(self, filters):
+        since = None
+        delay = 1
+        while True:
+            try:
+                events = self.client.events(
+                    since=since, decode=True, filters=filters)
+                for event in events:
+                    since = event.get('time', since)
+                    delay = 1
+                    self._loop.call_soon_threadsafe(self._on_event, event)
+            except Exception as e:
+                self.log.warning('docker events stream failed: %s', e)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _on_event(self, event):
+        event_type = event.get('Type')
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if event_type == 'node':
+            self._pending_all = True
+        else:
+            if event_type == 'service':
+                name = attributes.get('name')
+            else:
+                name = attributes.get('com.docker.swarm.service.name')
+            if name not in self._spawners:
+                return
+            self._pending.add(name)
+        self.log.debug('docker event: %s %s %s', event_type,
+                       event.get('Action'), event.get('Actor', {}).get('ID'))
+
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(
+                self.delay, lambda: asyncio.ensure_future(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        if self._pending_all:
+            names = list(self._spawners)
+        else:
+            names = list(self._pending)
+        self._pending = set()
+        self._pending_all = False
+
+        if self.snapshot is not None:
+            try:
+                await self.snapshot.refresh()
+            except Exception:
+                self.log.exception('failed to refresh swarm snapshot')
+
+        spawners = [self._spawners[n] for n in names if n in self._spawners]
+        results = await asyncio.gather(
+            *[s.poll_and_notify() for s in spawners], return_exceptions=True)
+        for spawner, result in zip(spawners, results):
+            if isinstance(result, Exception):
+                self.log.error('failed to poll %s: %s',
+                               spawner.service_name, result)
@@ -0,0 +1,95 @@
+"""
+Prometheus metrics of the spawners
+
+The metrics are registered in the default registry of prometheus_client,
+so that the hub exports them through its `/metrics` endpoint
+with the hub's namespace prefix, e.g.
+`jupyterhub_spawn_phase_duration_seconds`.
+"""
+
+import time
+from contextlib import contextmanager
+from enum import Enum
+
+from jupyterhub.metrics import metrics_prefix
+from prometheus_client import Histogram
+
+
+class SpawnPhase(Enum):
+    """
+    Phases of spawning a single-user server
+    """
+
+    options_form = 'options_form'
+    user_id = 'user_id'
+    registry_login = 'registry_login'
+    provision_dirs = 'provision_dirs'
+    create_service = 'create_service'
+    # wait for the task to run, including the image pull on the node
+    start_service = 'start_service'
+    # wait for the single-user server to respond
+    boot = 'boot'
+
+    def __str__(self):
+        return self.value
+
+
+spawn_phase_buckets = [
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    float("inf"),
+]
+
+SPAWN_PHASE_DURATION_SECONDS = Histogram(
+    'spawn_phase_duration_seconds',
+    'Time taken for each phase of spawning a single-user server',
+    ['phase', 'course', 'image'],
+    buckets=spawn_phase_buckets,
+    namespace=metrics_prefix,
+)
+
+
+def observe_phase(spawner, phase, duration):
+    """
+    Record the duration of a spawn phase, and log it if it is slow.
+    """
+    course = spawner.name or ''
+    image = spawner.image or ''
+    SPAWN_PHASE_DURATION_SECONDS.labels(
+        phase=str(phase), course=course, image=image).observe(duration)
+
+    threshold = spawner.slow_spawn_phase_threshold
+    if threshold and duration >= threshold:
+        fields = {
+            'phase': str(phase),
+            'user': spawner.user.name,
+            'course': course,
+            'image': image,
+            'duration': round(duration, 3),
+        }
+        spawner.log.warning(
+            'slow spawn phase: %s',
+            ' '.join(f'{k}={v}' for k, v in fields.items()),
+            extra={'spawn_phase': fields})
+
+
+@contextmanager
+def time_phase(spawner, phase):
+    """
+    Time a spawn phase of `spawner`.  Failed phases are not recorded.
+    """
+    start = time.perf_counter()
+    yield
+    observe_phase(spawner, phase, time.perf_counter() - start)
@@ -0,0 +1,108 @@
+import asyncio
+import csv
+import io
+import json
+
+from jupyterhub import orm
+from jupyterhub.apihandlers import APIHandler
+from jupyterhub.scopes import needs_scope
+from jupyterhub.utils import maybe_future
+from tornado import web
+
+
+class ProvisionUsersAPIHandler(APIHandler):
+    """
+    Create users of a roster and look up their user IDs ahead of time,
+    so that their first servers start without calling restuser service.
+
+    The request body is a JSON object with one or more of:
+
+    - `usernames`: list of user names
+    - `group`: name of a hub group whose members are provisioned
+    - `csv`: CSV text with a `username` column, or user names
+      in the first column if there is no such header
+    - `concurrency`: maximum number of concurrent lookups (default 16)
+
+    Register with:
+
+        c.JupyterHub.extra_handlers.append(
+            (r'/api/courseware/provision', ProvisionUsersAPIHandler))
+    """
+
+    @needs_scope('admin:users')
+    async def post(self):
+        data = self.get_json_body()
+        if not data or not isinstance(data, dict):
+            raise web.HTTPError(400, "Must specify a roster to provision")
+
+        usernames = self._get_roster(data)
+        if not usernames:
+            raise web.HTTPError(400, "No users to provision")
+
+        invalid_names = [
+            name for name in usernames
+            if not self.authenticator.validate_username(name)
+        ]
+        if invalid_names:
+            raise web.HTTPError(
+                400, "Invalid usernames: {}".format(', '.join(invalid_names)))
+
+        concurrency = data.get('concurrency', 16)
+        if not isinstance(concurrency, int) or concurrency <= 0:
+            raise web.HTTPError(400, "concurrency must be a positive integer")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def provision(name):
+            async with semaphore:
+                return await self._provision_user(name)
+
+        results = await asyncio.gather(
+            *[provision(name) for name in usernames])
+        self.db.commit()
+
+        self.log.info('provisioned %d users, %d failed',
+                      sum(1 for r in results if 'error' not in r),
+                      sum(1 for r in results if 'error' in r))
+        self.write(json.dumps({'users': results}))
+
+    def _get_roster(self, data):
+        names = []
+        names.extend(data.get('usernames') or [])
+
+        group_name = data.get('group')
+        if group_name:
+            group = orm.Group.find(self.db, group_name)
+            if group is None:
+                raise web.HTTPError(404, f"No such group: {group_name}")
+            names.extend(u.name for u in group.users)
+
+        if data.get('csv'):
+            rows = list(csv.reader(io.StringIO(data['csv'])))
+            column = 0
+            if rows and 'username' in rows[0]:
+                column = rows[0].index('username')
+                rows = rows[1:]
+            names.extend(
+                row[column] for row in rows
+                if len(row) > column and row[column].strip())
+
+        # deduplicate, keeping the order of the roster
+        return list(dict.fromkeys(
+            self.authenticator.normalize_username(name.strip())
+            for name in names))
+
+    async def _provision_user(self, name):
+        try:
+            user = self.find_user(name)
+            if user is None:
+                user = self.user_from_username(name)
+                await maybe_future(self.authenticator.add_user(user))
+
+            spawner = user.spawner
+            user_id = await spawner.resolve_user_id()
+            if 'user_id' not in (spawner.orm_spawner.state or {}):
+                spawner.orm_spawner.state = spawner.get_state()
+        except Exception as e:
+            self.log.error('failed to provision user %s', name, exc_info=True)
+            return {'name': name, 'error': str(e)}
+        return {'name': name, 'user_id': user_id}
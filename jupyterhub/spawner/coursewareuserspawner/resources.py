@@ -0,0 +1,81 @@
+RESERVED_GROUPS = ('admin', 'default')
+
+
+def _allocation_key(resources):
+    if resources is None:
+        return None
+    return (resources.mem_limit, resources.cpu_limit,
+            resources.mem_guarantee, resources.cpu_guarantee,
+            resources.priority)
+
+
+def resource_settings_key(group_resources, default_resources, admin_resources):
+    """
+    Return a hashable snapshot of resource allocation settings.
+
+    Spawners get their own copies of the configured `ResourceAllocation`
+    objects, so the settings are compared by value.
+    """
+    return (
+        frozenset((g, _allocation_key(c)) for g, c in group_resources.items()),
+        _allocation_key(default_resources),
+        _allocation_key(admin_resources),
+    )
+
+
+class ResourceTable:
+    """
+    Resource allocation settings compiled for lookups by a user's groups.
+
+    The effective `ResourceAllocation` is memoized per set of groups.
+    """
+
+    max_resolved = 4096
+
+    def __init__(self, group_resources, default_resources, admin_resources):
+        self.group_resources = group_resources
+        self.default_resources = default_resources
+        self.admin_resources = admin_resources
+        self.key = resource_settings_key(
+            group_resources, default_resources, admin_resources)
+
+        ranked = sorted(
+            [(g, c) for g, c in group_resources.items()
+             if g not in RESERVED_GROUPS and c is not None],
+            key=lambda x: x[1].priority)
+        self._ranks = {g: rank for rank, (g, _) in enumerate(ranked)}
+        self._resources = [c for _, c in ranked]
+        self._resolved = {}
+
+    def matches(self, group_resources, default_resources, admin_resources):
+        """
+        Check whether the table was compiled from the given settings.
+        """
+        return self.key == resource_settings_key(
+            group_resources, default_resources, admin_resources)
+
+    def resolve(self, groups, admin):
+        """
+        Return the `ResourceAllocation` for a user in `groups`,
+        which is a frozenset of group names.
+        """
+        key = (groups, admin)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        resources = None
+        if admin and self.admin_resources is not None:
+            resources = self.admin_resources
+        else:
+            ranks = [self._ranks[g] for g in groups if g in self._ranks]
+            if ranks:
+                resources = self._resources[min(ranks)]
+        if resources is None:
+            resources = self.default_resources
+
+        if len(self._resolved) >= self.max_resolved:
+            self._resolved.clear()
+        self._resolved[key] = resources
+        return resources
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import socket
+
+from jupyterhub.utils import maybe_future
+from tornado.httpclient import AsyncHTTPClient
+from tornado.log import app_log
+from tornado.netutil import Resolver
+
+
+RESTUSER_HOST = 'unix+restuser'
+
+
+class UnixResolver(Resolver):
+    """
+    Resolver that connects `RESTUSER_HOST` to a UNIX domain socket.
+    """
+
+    def initialize(self, socket_path):
+        self.socket_path = socket_path
+
+    async def resolve(self, host, port, family=socket.AF_UNSPEC):
+        if host != RESTUSER_HOST:
+            raise IOError('unknown host: {}'.format(host))
+        return [(socket.AF_UNIX, self.socket_path)]
+
+
+class RestUserClient:
+    """
+    Client of the restuser service that looks up or creates system users.
+
+    Clients are shared per socket path, so that all spawners of the hub
+    use the same HTTP client.
+    """
+
+    _instances = {}
+
+    @classmethod
+    def instance(cls, socket_path, **kwargs):
+        client = cls._instances.get(socket_path)
+        if client is None:
+            client = cls._instances[socket_path] = cls(socket_path, **kwargs)
+        return client
+
+    def __init__(self, socket_path, request_timeout=30, max_clients=10):
+        self.socket_path = socket_path
+        self.request_timeout = request_timeout
+        self._client = AsyncHTTPClient(
+            force_instance=True,
+            resolver=UnixResolver(socket_path=socket_path),
+            max_clients=max_clients)
+
+    async def get_uid(self, username):
+        """
+        Return the user ID of `username`, adding the user if not found.
+        """
+        resp = await self._client.fetch(
+            'http://{}/{}'.format(RESTUSER_HOST, username),
+            method='POST',
+            body='{}',
+            request_timeout=self.request_timeout)
+        return json.loads(resp.body.decode('utf8', 'replace'))['uid']
+
+
+class UserIdCache:
+    """
+    In-memory cache of user IDs.
+
+    Concurrent lookups of the same user are coalesced into one.
+    """
+
+    def __init__(self, log=None):
+        self.log = log or app_log
+        self._uids = {}
+        self._pending = {}
+
+    def get(self, username):
+        return self._uids.get(username)
+
+    def set(self, username, uid):
+        if uid is not None and uid >= 0:
+            self._uids[username] = uid
+
+    async def resolve(self, username, lookup):
+        """
+        Return the cached user ID of `username` or call `lookup`,
+        which returns the user ID or an awaitable of it.
+        """
+        uid = self._uids.get(username)
+        if uid is not None:
+            return uid
+        pending = self._pending.get(username)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(username, lookup))
+            self._pending[username] = pending
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, username, lookup):
+        try:
+            uid = await maybe_future(lookup())
+            self.log.debug('user id of %s: %s', username, uid)
+            self.set(username, uid)
+            return uid
+        finally:
+            self._pending.pop(username, None)
+
+
+user_ids = UserIdCache()
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from tornado.log import app_log
+
+
+SPAWNER_LABEL = 'coursewareuserspawner.user'
+
+
+class SwarmSnapshot:
+    """
+    Hub-wide snapshot of the services of single-user servers and their tasks.
+
+    The snapshot is refreshed by listing the labelled services and
+    their tasks once per interval, so that spawners answer `poll()` without
+    calling the Docker API for each server.
+    """
+
+    # number of services whose tasks are listed by one request
+    task_batch_size = 100
+
+    _instance = None
+
+    @classmethod
+    def instance(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def __init__(self, docker, interval=10.0, log=None):
+        self.docker = docker
+        self.interval = interval
+        self.log = log or app_log
+        self._services = {}
+        self._tasks = {}
+        self._refreshed = None
+        self._invalidated = {}
+        self._refresh_lock = None
+        self._refresh_task = None
+        self._pending_refresh = None
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                self.log.exception('failed to refresh swarm snapshot')
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self):
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            started = time.monotonic()
+            services = await self.docker(
+                'services', filters={'label': SPAWNER_LABEL})
+            by_id = {s['ID']: [] for s in services}
+            ids = list(by_id)
+            tasks = []
+            for i in range(0, len(ids), self.task_batch_size):
+                tasks.extend(await self.docker(
+                    'tasks',
+                    filters={'service': ids[i:i + self.task_batch_size]}))
+
+            for task in tasks:
+                service_tasks = by_id.get(task.get('ServiceID'))
+                if service_tasks is not None:
+                    service_tasks.append(task)
+
+            self._services = {s['Spec']['Name']: s for s in services}
+            self._tasks = by_id
+            self._refreshed = started
+            self._invalidated = {
+                name: t for name, t in self._invalidated.items()
+                if t >= started
+            }
+            self.log.debug('swarm snapshot: %d services, %d tasks in %.3fs',
+                           len(services), len(tasks),
+                           time.monotonic() - started)
+
+    async def ensure_fresh(self):
+        """
+        Refresh the snapshot if it is stale.
+
+        Concurrent callers share one refresh, so that the spawners checked
+        at hub startup are restored from a single listing.
+        """
+        if self.fresh:
+            return
+        if self._pending_refresh is None or self._pending_refresh.done():
+            self._pending_refresh = asyncio.ensure_future(self.refresh())
+        await asyncio.shield(self._pending_refresh)
+
+    @property
+    def fresh(self):
+        return (self._refreshed is not None and
+                time.monotonic() - self._refreshed < 3 * self.interval)
+
+    def get_service(self, name, service_id=None):
+        """
+        Return the service named `name`, or None if it is not in
+        the snapshot, the snapshot is stale, or the service was invalidated
+        after the last refresh.
+
+        If `service_id` is given, a service of the same name with another ID,
+        i.e. one removed and created again after the refresh, is ignored.
+        """
+        if not self.fresh:
+            return None
+        if self._invalidated.get(name, -1) >= self._refreshed:
+            return None
+        service = self._services.get(name)
+        if service is not None and service_id and service['ID'] != service_id:
+            return None
+        return service
+
+    def invalidate(self, name):
+        """
+        Ignore the service named `name` until the next refresh, e.g. after
+        it was created or updated and its tasks changed.
+        """
+        self._invalidated[name] = time.monotonic()
+
+    def get_task(self, service):
+        """
+        Return the task of `service` as `SwarmSpawner.get_task` does:
+        the task desired to be running, otherwise the latest task.
+
+        Raises LookupError if the service has more than one such task.
+        """
+        tasks = self._tasks.get(service['ID']) or []
+        running = [t for t in tasks if t.get('DesiredState') == 'running']
+        if len(running) > 1:
+            raise LookupError(service['Spec']['Name'])
+        if running:
+            return running[0]
+        if tasks:
+            return max(tasks, key=lambda t: t.get('UpdatedAt', ''))
+        return None
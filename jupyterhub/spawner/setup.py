@@ -41,7 +41,6 @@ setup_args = dict(
     long_description    = "Spawn single-user servers with Docker.",
     platforms           = "Linux, Mac OS X",
     install_requires    = [
-        'requests-unixsocket',
         'dockerspawner'
     ],
     cmdclass = {
@@ -0,0 +1,43 @@
+import asyncio
+from unittest import mock
+
+from aiohttp import web
+
+import coursewareuserspawner
+from coursewareuserspawner import CoursewareUserSpawner
+from coursewareuserspawner.metrics import SpawnPhase
+
+
+async def _time_boot():
+    async def api(request):
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_get('/user/a/api', api)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    user = mock.Mock()
+    user.name = 'a'
+    user.settings = {}
+    spawner = CoursewareUserSpawner(user=user)
+    server = mock.Mock()
+    server.base_url = '/user/a/'
+    try:
+        with mock.patch.object(CoursewareUserSpawner, 'server', server), \
+                mock.patch.object(coursewareuserspawner,
+                                  'observe_phase') as observe:
+            await spawner._time_boot(('127.0.0.1', port), 0)
+        return observe
+    finally:
+        await runner.cleanup()
+
+
+def test_boot_is_timed_when_the_server_responds():
+    observe = asyncio.run(_time_boot())
+    spawner, phase, duration = observe.call_args.args
+    assert phase is SpawnPhase.boot
+    assert duration > 0
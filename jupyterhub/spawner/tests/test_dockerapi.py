@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from unittest import mock
+
+from coursewareuserspawner import CoursewareUserSpawner
+from coursewareuserspawner.dockerapi import DockerAPI
+from coursewareuserspawner.snapshot import SwarmSnapshot
+
+
+def test_calls_run_in_own_thread():
+    client = mock.Mock()
+    client.services.side_effect = lambda **kwargs: threading.get_ident()
+    api = DockerAPI(client)
+
+    async def call():
+        return await api('services', filters={'label': 'x'})
+
+    assert asyncio.run(call()) != threading.get_ident()
+    client.services.assert_called_once_with(filters={'label': 'x'})
+
+
+def test_snapshot_has_own_client(monkeypatch):
+    monkeypatch.setattr(SwarmSnapshot, '_instance', None)
+    monkeypatch.setattr(SwarmSnapshot, 'start', lambda self: None)
+    monkeypatch.setattr(CoursewareUserSpawner, '_client', None)
+    monkeypatch.setattr('docker.APIClient',
+                        mock.Mock(side_effect=lambda **kwargs: mock.Mock()))
+    user = mock.Mock()
+    user.name = 'a'
+    a = CoursewareUserSpawner(user=user)
+    b = CoursewareUserSpawner(user=user)
+
+    snapshot = a._get_swarm_snapshot()
+    assert b._get_swarm_snapshot() is snapshot
+    assert isinstance(snapshot.docker, DockerAPI)
+    assert snapshot.docker.client is not a.client
+    assert snapshot.docker.executor is not a.executor
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from traitlets.config import Config
+
+from coursewareuserspawner import CoursewareUserSpawner
+from coursewareuserspawner.traitlets import ResourceAllocation
+
+
+def _user(name, groups):
+    user = mock.Mock()
+    user.name = name
+    user.admin = False
+    user.groups = []
+    for g in groups:
+        group = mock.Mock()
+        group.name = g
+        user.groups.append(group)
+    return user
+
+
+def test_spawners_share_resource_table(monkeypatch):
+    monkeypatch.setattr(CoursewareUserSpawner, '_resource_table', None)
+    c = Config()
+    c.CoursewareUserSpawner.group_resources = {
+        'class-a': ResourceAllocation(mem_limit='2G', priority=1),
+        'class-b': ResourceAllocation(mem_limit='4G', priority=0),
+    }
+    c.CoursewareUserSpawner.default_resources = ResourceAllocation(
+        mem_limit='1G')
+
+    a = CoursewareUserSpawner(config=c, user=_user('a', ['class-a']))
+    b = CoursewareUserSpawner(config=c, user=_user('b', ['class-a', 'class-b']))
+
+    assert a.group_resources is not b.group_resources
+    assert a._get_resource_table() is b._get_resource_table()
+    assert a._get_resource_config('mem_limit') == 2 * 1024 ** 3
+    assert b._get_resource_config('mem_limit') == 4 * 1024 ** 3
+
+
+def test_resource_table_is_rebuilt_on_change(monkeypatch):
+    monkeypatch.setattr(CoursewareUserSpawner, '_resource_table', None)
+    a = CoursewareUserSpawner(user=_user('a', []))
+    table = a._get_resource_table()
+
+    a.default_resources = ResourceAllocation(mem_limit='1G')
+    assert a._get_resource_table() is not table
+
+
+def test_resource_settings_are_compared_once(monkeypatch):
+    monkeypatch.setattr(CoursewareUserSpawner, '_resource_table', None)
+    a = CoursewareUserSpawner(user=_user('a', []))
+    a._get_resource_table()
+    with mock.patch('coursewareuserspawner.resources.resource_settings_key') \
+            as key:
+        for name in ('cpu_limit', 'cpu_guarantee',
+                     'mem_limit', 'mem_guarantee'):
+            a._get_resource_config(name)
+    key.assert_not_called()
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from dockerspawner import SwarmSpawner
+
+from coursewareuserspawner import CoursewareUserSpawner
+from coursewareuserspawner.snapshot import SPAWNER_LABEL, SwarmSnapshot
+
+
+def _service(i):
+    return {'ID': f'svc-{i}', 'Spec': {'Name': f'jupyter-{i}'}}
+
+
+class FakeDocker:
+
+    def __init__(self, services, tasks):
+        self.services = services
+        self.tasks = tasks
+        self.calls = []
+
+    async def __call__(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        if method == 'services':
+            return self.services
+        ids = kwargs['filters']['service']
+        return [t for t in self.tasks if t['ServiceID'] in ids]
+
+
+def test_tasks_are_listed_for_labelled_services():
+    services = [_service(i) for i in range(3)]
+    tasks = [{'ID': f't-{i}', 'ServiceID': f'svc-{i}'} for i in range(3)]
+    docker = FakeDocker(services, tasks)
+    snapshot = SwarmSnapshot(docker=docker)
+    snapshot.task_batch_size = 2
+    asyncio.run(snapshot.refresh())
+
+    assert docker.calls == [
+        ('services', {'filters': {'label': SPAWNER_LABEL}}),
+        ('tasks', {'filters': {'service': ['svc-0', 'svc-1']}}),
+        ('tasks', {'filters': {'service': ['svc-2']}}),
+    ]
+    assert snapshot.get_task(services[2]) == tasks[2]
+
+
+def test_invalidated_service_is_ignored_until_next_refresh():
+    service = _service(0)
+    snapshot = SwarmSnapshot(docker=FakeDocker([service], []))
+    asyncio.run(snapshot.refresh())
+    assert snapshot.get_service('jupyter-0') is service
+
+    snapshot.invalidate('jupyter-0')
+    assert snapshot.get_service('jupyter-0') is None
+    asyncio.run(snapshot.refresh())
+    assert snapshot.get_service('jupyter-0') is service
+
+
+def _poll(tasks, started_at):
+    user = mock.Mock()
+    user.name = 'a'
+    spawner = CoursewareUserSpawner(user=user, swarm_events=False)
+    spawner.object_name = 'jupyter-0'
+    spawner.object_id = 'svc-0'
+    spawner._started_at = started_at
+    snapshot = SwarmSnapshot(docker=FakeDocker([_service(0)], tasks))
+    spawner._get_swarm_snapshot = lambda: snapshot
+    asyncio.run(snapshot.refresh())
+    with mock.patch.object(SwarmSpawner, 'poll', return_value=None) as poll:
+        status = asyncio.run(spawner.poll())
+    return status, poll.called
+
+
+def test_poll_checks_service_without_task():
+    assert _poll([], None) == (None, True)
+
+
+def test_poll_ignores_tasks_shut_down_before_start():
+    now = datetime.now(timezone.utc)
+    task = {
+        'ID': 't', 'ServiceID': 'svc-0', 'DesiredState': 'shutdown',
+        'CreatedAt': (now - timedelta(hours=1)).isoformat(),
+        'Status': {'State': 'shutdown'},
+    }
+    assert _poll([task], now) == (None, True)
+
+    status, live = _poll([task], now - timedelta(hours=2))
+    assert not live
+    assert 'shutdown' in status
@@ -0,0 +1,109 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from dockerspawner import SwarmSpawner
+
+from coursewareuserspawner import CoursewareUserSpawner
+
+
+def _spawner(**kwargs):
+    user = mock.Mock()
+    user.name = 'a'
+    user.groups = []
+    spawner = CoursewareUserSpawner(user=user, suspend_on_stop=True,
+                                    image='course-a:latest', **kwargs)
+    spawner.object_id = 'svc'
+    return spawner
+
+
+def _service(name, image):
+    return {
+        'ID': 'svc',
+        'Version': {'Index': 1},
+        'Spec': {
+            'Name': name,
+            'TaskTemplate': {'ContainerSpec': {'Image': image}},
+        },
+    }
+
+
+def test_only_running_servers_are_suspended():
+    spawner = _spawner()
+    spawner.get_task = mock.AsyncMock(
+        return_value={'Status': {'State': 'failed'}})
+    spawner.docker = mock.AsyncMock()
+    with mock.patch.object(SwarmSpawner, 'stop') as stop:
+        asyncio.run(spawner.stop())
+    stop.assert_called_once()
+    spawner.docker.assert_not_called()
+    assert not spawner._suspended
+
+
+def test_servers_that_did_not_respond_are_not_suspended():
+    spawner = _spawner()
+    spawner._responded = False
+    spawner._suspend = mock.AsyncMock()
+    with mock.patch.object(SwarmSpawner, 'stop') as stop:
+        asyncio.run(spawner.stop())
+    stop.assert_called_once()
+    spawner._suspend.assert_not_called()
+
+
+def test_suspended_service_of_another_image_is_removed():
+    spawner = _spawner()
+    spawner._suspended = True
+    spawner.resolve_user_id = mock.AsyncMock()
+    spawner.remove_object = mock.AsyncMock()
+    spawner._get_suspended_service = mock.AsyncMock(return_value=_service(
+        spawner.object_name, 'course-b:latest@sha256:abc'))
+    spawner._resume = mock.AsyncMock()
+    spawner._time_boot = mock.AsyncMock()
+    with mock.patch.object(SwarmSpawner, 'start',
+                           return_value=('127.0.0.1', 8888)) as start:
+        asyncio.run(spawner.start())
+    spawner.remove_object.assert_called_once()
+    spawner._resume.assert_not_called()
+    start.assert_called_once()
+    assert not spawner._suspended
+
+
+def test_resume_pulls_image_and_runs_post_start():
+    spawner = _spawner(post_start_cmd='true')
+    service = _service(spawner.object_name, 'course-a:latest@sha256:abc')
+    assert spawner._can_resume(service)
+    spawner.pull_image = mock.AsyncMock()
+    spawner.create_object = mock.AsyncMock()
+    spawner.start_object = mock.AsyncMock()
+    spawner.post_start_exec = mock.AsyncMock()
+    spawner.get_ip_and_port = mock.AsyncMock(return_value=('10.0.0.1', 8888))
+    spawner.docker = mock.AsyncMock(return_value=[{'ID': 'task'}])
+
+    ip_port = asyncio.run(spawner._resume(service))
+
+    assert ip_port == ('10.0.0.1', 8888)
+    spawner.pull_image.assert_called_once_with('course-a:latest')
+    spawner.post_start_exec.assert_called_once()
+
+
+def test_retried_create_service_resumes_the_service():
+    spawner = _spawner()
+    spawner._resume_service = _service(spawner.object_name, 'course-a:latest')
+    with mock.patch.object(SwarmSpawner, 'docker') as docker:
+        for _ in range(2):
+            spawner.docker('create_service', name='new', task_template={})
+    assert [c.args[0] for c in docker.call_args_list] == [
+        'update_service', 'update_service']
+
+
+def test_resume_gives_up_waiting_for_a_task():
+    spawner = _spawner(start_timeout=0)
+    spawner.pull_image = mock.AsyncMock()
+    spawner.create_object = mock.AsyncMock()
+    spawner.start_object = mock.AsyncMock()
+    spawner.docker = mock.AsyncMock(return_value=[])
+    service = _service(spawner.object_name, 'course-a:latest')
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(spawner._resume(service))
+    spawner.start_object.assert_not_called()